@@ -0,0 +1,11 @@
+"""
+Benchmarks against a real database, the docker-compose one by default.
+
+Run from the repository root with `src` on the path, e.g.::
+
+    PYTHONPATH=src python -m benchmarks.datagen --teams 100000 --experiments 1000000 --reset
+    PYTHONPATH=src python -m benchmarks.run --output before.json
+    PYTHONPATH=src python -m benchmarks.compare before.json after.json
+
+`benchmarks.serialization` is a micro-benchmark and needs no database.
+"""
@@ -0,0 +1,38 @@
+"""Compare two `benchmarks.run` reports, e.g. of two commits."""
+import argparse
+import json
+
+METRICS = ('p50_ms', 'p99_ms', 'throughput_rps')
+
+
+def compare(before: dict, after: dict) -> list[tuple[str, str, float, float, float]]:
+    """Return (scenario, metric, before, after, after / before) of the shared scenarios."""
+
+    rows = []
+    for scenario, results in after['scenarios'].items():
+        if (previous := before['scenarios'].get(scenario)) is None:
+            continue
+        for metric in METRICS:
+            ratio = results[metric] / previous[metric] if previous[metric] else float('inf')
+            rows.append((scenario, metric, previous[metric], results[metric], ratio))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    for scenario, metric, previous, current, ratio in compare(before, after):
+        print(f'{scenario:<20} {metric:<16} {previous:>12} {current:>12} {ratio:>8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
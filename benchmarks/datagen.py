@@ -0,0 +1,203 @@
+"""
+Synthetic org chart and experiments.
+
+Teams are generated level by level: `roots` top-level teams, then the others
+spread evenly over `depth - 1` levels, each below a random team of the level
+above. A small depth gives wide, shallow trees, a large one deep trees.
+
+Experiments get one or two teams, two teams are always taken from different
+top-level trees so that they are never related, as the API requires.
+
+Rows are loaded with COPY, the triggers maintaining the team closure, the
+experiment team ids, the team stats and the data versions run as they do for
+API writes.
+"""
+import argparse
+import io
+import sys
+import time
+
+import numpy as np
+
+from db import db_models
+from db.db_models import setup_db
+
+# Rows sent per COPY
+COPY_CHUNK_SIZE = 100_000
+
+
+def team_parents(teams: int, depth: int, roots: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Return the parent index of every team, -1 for roots.
+
+    Parents always come before their children.
+    """
+
+    roots = min(roots, teams)
+    parents = np.full(teams, -1, dtype=np.int64)
+    levels = [np.arange(roots)]
+    for level in np.array_split(np.arange(roots, teams), max(depth - 1, 1)):
+        if not len(level):
+            continue
+        above = levels[-1]
+        parents[level] = above[rng.integers(0, len(above), len(level))]
+        levels.append(level)
+
+    return parents
+
+
+def team_roots(parents: np.ndarray) -> np.ndarray:
+    """Return the index of the top-level team above every team."""
+
+    roots = np.arange(len(parents))
+    # parents come first, a single forward pass resolves every root
+    for team, parent in enumerate(parents):
+        if parent >= 0:
+            roots[team] = roots[parent]
+    return roots
+
+
+def experiment_teams(
+    experiments: int, roots: np.ndarray, two_teams_ratio: float, rng: np.random.Generator
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the (experiment index, team index) pairs of the experiments.
+
+    About `two_teams_ratio` of the experiments get a second, unrelated team.
+    """
+
+    first = rng.integers(0, len(roots), experiments)
+    second = rng.integers(0, len(roots), experiments)
+    two_teams = (rng.random(experiments) < two_teams_ratio) & (roots[first] != roots[second])
+
+    experiment_index = np.arange(experiments)
+    return (
+        np.concatenate((experiment_index, experiment_index[two_teams])),
+        np.concatenate((first, second[two_teams])),
+    )
+
+
+def _copy(cursor, table: str, columns: tuple[str, ...], rows):
+    """COPY `rows`, tuples of ints or strings free of tabs and newlines, into `table`."""
+
+    rows = iter(rows)
+    while True:
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            buffer.write('\t'.join(map(str, row)))
+            buffer.write('\n')
+            count += 1
+            if count == COPY_CHUNK_SIZE:
+                break
+        if not count:
+            return
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def generate(
+    connection,
+    teams: int,
+    experiments: int,
+    depth: int = 6,
+    roots: int = 20,
+    two_teams_ratio: float = 0.5,
+    seed: int = 0,
+):
+    """
+    Load a synthetic dataset through a psycopg2 `connection`, into empty tables.
+
+    Ids are assigned here, teams and experiments get ids from 1 in generation
+    order, then the id sequences are moved past them.
+    """
+
+    rng = np.random.default_rng(seed)
+    parents = team_parents(teams, depth, roots, rng)
+    experiment_index, team_index = experiment_teams(
+        experiments, team_roots(parents), two_teams_ratio, rng
+    )
+    sample_ratios = rng.integers(0, 101, experiments)
+
+    with connection.cursor() as cursor:
+        _copy(
+            cursor,
+            'team',
+            ('id', 'name', 'parent_team_id'),
+            (
+                (team + 1, f'team-{team + 1}', parent + 1 if parent >= 0 else r'\N')
+                for team, parent in enumerate(parents.tolist())
+            ),
+        )
+        _copy(
+            cursor,
+            'experiment',
+            ('id', 'description', 'sample_ratio'),
+            (
+                (experiment + 1, f'experiment {experiment + 1}', sample_ratio)
+                for experiment, sample_ratio in enumerate(sample_ratios.tolist())
+            ),
+        )
+        _copy(
+            cursor,
+            'experiments_teams',
+            ('experiment_id', 'team_id'),
+            zip((experiment_index + 1).tolist(), (team_index + 1).tolist()),
+        )
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('team', 'id'), %s, true)", (max(teams, 1),)
+        )
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('experiment', 'id'), %s, true)",
+            (max(experiments, 1),),
+        )
+        # Fresh planner statistics, plans of an unanalyzed dataset are meaningless
+        cursor.execute("ANALYZE team, experiment, experiments_teams, team_closure")
+    connection.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--teams', type=int, default=10_000)
+    parser.add_argument('--experiments', type=int, default=100_000)
+    parser.add_argument('--depth', type=int, default=6, help='levels of the team hierarchy')
+    parser.add_argument('--roots', type=int, default=20, help='top-level teams')
+    parser.add_argument('--two-teams-ratio', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--reset', action='store_true', help='empty the tables first, instead of failing'
+    )
+    args = parser.parse_args()
+
+    setup_db()
+    connection = db_models.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            if args.reset:
+                cursor.execute(
+                    "TRUNCATE team, experiment, experiments_teams, team_closure, team_stats"
+                )
+            cursor.execute("SELECT EXISTS (SELECT FROM team) OR EXISTS (SELECT FROM experiment)")
+            if cursor.fetchone()[0]:
+                sys.exit('The database is not empty, use --reset to empty it first')
+
+        start = time.perf_counter()
+        generate(
+            connection,
+            args.teams,
+            args.experiments,
+            depth=args.depth,
+            roots=args.roots,
+            two_teams_ratio=args.two_teams_ratio,
+            seed=args.seed,
+        )
+        print(
+            f'{args.teams} teams and {args.experiments} experiments generated'
+            f' in {time.perf_counter() - start:.1f}s'
+        )
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
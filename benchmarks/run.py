@@ -0,0 +1,205 @@
+"""
+Latency and throughput of the API endpoints.
+
+Every scenario sends `--requests` requests from `--concurrency` threads, to
+the app in process or to a running server given with `--url`, and reports
+its latency percentiles and throughput as JSON, see `benchmarks.compare`.
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy import select
+
+from api.app import create_app
+from db import db_models
+from db.db_models import Experiment
+from db.db_models import Team
+
+# (method, path, JSON body) of a request
+Request = tuple[str, str, dict | None]
+
+
+class InProcessClient:
+    """Client calling the app in process, through one Flask test client per thread."""
+
+    def __init__(self):
+        self.app = create_app()
+        self.local = threading.local()
+
+    def __call__(self, method: str, path: str, body: dict | None) -> int:
+        if (client := getattr(self.local, 'client', None)) is None:
+            client = self.local.client = self.app.test_client()
+        return client.open(path, method=method, json=body).status_code
+
+
+class HTTPClient:
+    """Client calling a running server."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+
+    def __call__(self, method: str, path: str, body: dict | None) -> int:
+        request = urllib.request.Request(
+            self.url + path,
+            method=method,
+            data=None if body is None else json.dumps(body).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as err:
+            return err.code
+
+
+def scenarios(rng: random.Random) -> dict[str, Callable[[], Request]]:
+    """Return the request generators of every scenario, for the current dataset."""
+
+    session = db_models.get_session()
+    max_team_id = session.scalar(select(func.max(Team.id))) or 0
+    if not max_team_id or not session.scalar(select(func.count(Experiment.id))):
+        sys.exit('The database is empty, generate a dataset first, see `benchmarks.datagen`')
+
+    # the number of teams of an experiment can not change, update single team ones
+    single_team_ids = session.scalars(
+        select(Experiment.id).where(func.cardinality(Experiment.team_ids) == 1).limit(10000)
+    ).all()
+    # teams with sub teams make the team filter expand
+    parent_ids = session.scalars(
+        select(Team.parent_team_id).where(Team.parent_team_id.is_not(None)).distinct()
+    ).all()
+    session.close()
+
+    scenarios = {
+        'list': lambda: ('GET', f'/experiments?page={rng.randint(1, 100)}', None),
+        'list_sorted': lambda: (
+            'GET',
+            '/experiments?' + urlencode({'sort_by': 'sample_ratio', 'order_by': 'desc'}),
+            None,
+        ),
+        'list_team': lambda: (
+            'GET',
+            '/experiments?' + urlencode({'team_ids[]': rng.randint(1, max_team_id)}),
+            None,
+        ),
+        'list_parent_team': lambda: (
+            'GET',
+            '/experiments?' + urlencode({'team_ids[]': rng.choice(parent_ids)}),
+            None,
+        ),
+        'create': lambda: (
+            'POST',
+            '/experiments',
+            {
+                'description': 'bench',
+                'sample_ratio': 50,
+                'team_ids': [rng.randint(1, max_team_id)],
+            },
+        ),
+        'update': lambda: (
+            'PUT',
+            f'/experiments/{rng.choice(single_team_ids)}',
+            {'team_ids': [rng.randint(1, max_team_id)]},
+        ),
+    }
+    if not parent_ids:
+        # flat hierarchy
+        del scenarios['list_parent_team']
+    if not single_team_ids:
+        del scenarios['update']
+
+    return scenarios
+
+
+def run_scenario(client, make_request: Callable[[], Request], requests: int, concurrency: int):
+    requests_ = [make_request() for _ in range(requests)]
+    latencies = np.zeros(requests)
+    statuses = np.zeros(requests, dtype=np.int32)
+
+    def send(index: int):
+        start = time.perf_counter()
+        statuses[index] = client(*requests_[index])
+        latencies[index] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    p50, p90, p99 = (float(p) for p in np.percentile(latencies, (50, 90, 99)) * 1000)
+    return {
+        'requests': requests,
+        'errors': int((statuses >= 400).sum()),
+        'p50_ms': round(p50, 3),
+        'p90_ms': round(p90, 3),
+        'p99_ms': round(p99, 3),
+        'mean_ms': round(float(latencies.mean()) * 1000, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='server to benchmark, the app in process if omitted')
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per scenario')
+    parser.add_argument('--scenario', action='append', help='scenarios to run, all by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results to, stdout if omitted')
+    args = parser.parse_args()
+
+    if args.url:
+        client = HTTPClient(args.url)
+        db_models.setup_db()
+    else:
+        client = InProcessClient()
+
+    rng = random.Random(args.seed)
+    results = {}
+    for name, make_request in scenarios(rng).items():
+        if args.scenario and name not in args.scenario:
+            continue
+        for _ in range(args.warmup):
+            client(*make_request())
+        results[name] = run_scenario(client, make_request, args.requests, args.concurrency)
+        print(f'{name}: {results[name]}', file=sys.stderr)
+
+    report = {
+        'commit': git_commit(),
+        'target': args.url or 'in-process',
+        'concurrency': args.concurrency,
+        'scenarios': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
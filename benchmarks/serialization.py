@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of listing serialization, marshmallow against `api.serialization`.
+
+No database is involved: synthetic pages are serialized by both paths, which
+are first checked to produce the same bytes.
+"""
+import argparse
+import json
+import random
+import timeit
+
+from flask import Flask
+
+from api.resources import ExperimentSchema
+from api.serialization import experiments_json
+from api.serialization import listing_json
+from api.serialization import team_json
+from db.db_models import Experiment
+from db.db_models import Team
+
+
+def synthetic_page(size: int, rng: random.Random) -> list[Experiment]:
+    teams = [Team(id=team_id, name=f'team {team_id}') for team_id in range(1, 201)]
+    return [
+        Experiment(
+            id=experiment_id,
+            description=f'experiment {experiment_id} ' + 'x' * rng.randint(20, 200),
+            sample_ratio=rng.randint(0, 100),
+            teams=sorted(rng.sample(teams, rng.randint(1, 2)), key=lambda team: team.id),
+        )
+        for experiment_id in range(1, size + 1)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--size', type=int, action='append', help='page sizes, 25 and 500 by default'
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    meta = {'items': 0, 'limit': 0, 'next_cursor': None, 'order_by': 'asc', 'page': 1}
+    rng = random.Random(args.seed)
+
+    results = {}
+    for size in args.size or (25, 500):
+        page = synthetic_page(size, rng)
+        rows = [(e.id, e.description, e.sample_ratio, [team.id for team in e.teams]) for e in page]
+        # projected rows come with their team names
+        names = [(team.id, team.name) for e in page for team in e.teams]
+
+        def marshmallow():
+            data = ExperimentSchema(many=True).dump(page)
+            return app.json.response({"data": data, "meta": meta}).get_data()
+
+        def precompiled():
+            teams = {team_id: team_json(team_id, name) for team_id, name in names}
+            return listing_json(experiments_json(rows, teams), meta).encode()
+
+        assert marshmallow() == precompiled()
+
+        number = max(1, 5000 // size)
+        results[size] = {
+            name: min(timeit.repeat(serialize, number=number, repeat=args.repeat)) / number * 1e3
+            for name, serialize in (
+                ('marshmallow_ms', marshmallow),
+                ('precompiled_ms', precompiled),
+            )
+        }
+        results[size]['speedup'] = (
+            results[size]['marshmallow_ms'] / results[size]['precompiled_ms']
+        )
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 from flask import Flask
 from flask import jsonify
 
+from api import metrics
+from api import profiling
 from api.resources import bp
 from config import DEBUG
+from db.db_models import remove_session
 from db.db_models import setup_db
 
 
@@ -14,6 +17,14 @@ def create_app():
     # Register blueprint
     app.register_blueprint(bp)
 
+    # Sessions live as long as the request they serve
+    app.teardown_appcontext(remove_session)
+
+    # Request, SQL and serialization metrics, served on /metrics
+    metrics.init_app(app)
+    # Opt-in profiling of single requests, slow query log
+    profiling.init_app(app)
+
     # register an error handler
 
     # register a health endpoint
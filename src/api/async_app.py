@@ -0,0 +1,107 @@
+"""
+Asyncio variant of the API, served by uvicorn.
+
+Experiment listings are served natively on the event loop through an async
+engine, so a single process keeps many of them in flight while they wait on
+Postgres. Every other route is delegated to the WSGI app of `create_app`,
+running in a thread pool.
+"""
+import contextlib
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from marshmallow import ValidationError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.responses import Response
+from starlette.routing import Mount
+from starlette.routing import Route
+from werkzeug.http import parse_etags
+from werkzeug.http import quote_etag
+
+from api.app import create_app
+from api.resources import list_experiments
+from api.resources import listing_body
+from api.resources import listing_cache
+from api.resources import listing_etag
+from api.resources import load_experiment_filters
+from api.server import check_database_connections
+from config import SERVER_HOST
+from config import SERVER_PORT
+from config import SERVER_THREADS
+from config import SERVER_WORKERS
+from db import db_models
+from db.db_models import get_async_session
+from db.db_models import get_data_versions_async
+from db.db_models import get_team_tree_async
+from db.db_models import setup_async_db
+
+
+def create_async_app(wsgi_app=None):
+    wsgi_app = wsgi_app or create_app()
+    setup_async_db()
+
+    def listing_response(body: bytes, etag: str) -> Response:
+        return Response(
+            listing_body(wsgi_app, body),
+            media_type=wsgi_app.json.mimetype,
+            headers={'ETag': quote_etag(etag)},
+        )
+
+    async def get_experiments(request: Request):
+        """List experiments, same as `api.resources.get_experiments`."""
+
+        try:
+            filters = load_experiment_filters(request.query_params)
+        except ValidationError as err:
+            return JSONResponse(err.messages, status_code=400)
+
+        async with get_async_session() as session:
+            versions = await get_data_versions_async(session, 'experiments', 'team_tree')
+            etag = listing_etag(versions, filters)
+
+            if parse_etags(request.headers.get('If-None-Match')).contains(etag):
+                return Response(status_code=304, headers={'ETag': quote_etag(etag)})
+
+            if (body := listing_cache.get(etag)) is not None:
+                return listing_response(body, etag)
+
+            team_tree = None
+            if filters.get('team_ids[]'):
+                team_tree = await get_team_tree_async(session)
+
+            # The listing itself is shared with the WSGI app, its blocking
+            # calls are adapted to the async driver by `run_sync`
+            body = (await session.run_sync(list_experiments, filters, team_tree)).encode()
+
+        listing_cache.put(etag, body)
+
+        return listing_response(body, etag)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        await db_models.async_engine.dispose()
+
+    return Starlette(
+        routes=[
+            Route('/experiments', get_experiments, methods=['GET']),
+            # As many threads as the gunicorn workers, its pool is sized for them
+            Mount('/', app=WSGIMiddleware(wsgi_app, workers=SERVER_THREADS)),
+        ],
+        lifespan=lifespan,
+    )
+
+
+def run():
+    # The WSGI engine and the async one, both on the primary without a replica
+    check_database_connections(SERVER_WORKERS, engines=2)
+
+    uvicorn.run(
+        'api.async_app:create_async_app',
+        factory=True,
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=SERVER_WORKERS,
+    )
@@ -0,0 +1,167 @@
+"""
+Prometheus metrics, exposed on `/metrics`.
+
+Besides request latencies, requests are split into the time spent running
+SQL, waiting for a pooled connection and serializing, so a slow route can be
+told apart from a slow query or a slow encoder. Under the pre-forking server
+set `PROMETHEUS_MULTIPROC_DIR` so that every worker is aggregated.
+"""
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from flask import Flask
+from flask import Response
+from flask import g
+from flask import has_request_context
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import Schema
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry
+from prometheus_client import Histogram
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from db.db_models import TimedQueuePool
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Request latency, per route and status code.',
+    ['method', 'route', 'status'],
+)
+SQL_STATEMENT_SECONDS = Histogram(
+    'sql_statement_duration_seconds',
+    'Duration of single SQL statements, per route issuing them.',
+    ['route'],
+)
+SQL_REQUEST_STATEMENTS = Histogram(
+    'sql_request_statements',
+    'SQL statements issued by a request, per route.',
+    ['route'],
+    buckets=(0, 1, 2, 3, 4, 5, 10, 25, 50, 100),
+)
+SQL_REQUEST_SECONDS = Histogram(
+    'sql_request_duration_seconds',
+    'Time spent running SQL statements by a request, per route.',
+    ['route'],
+)
+POOL_CHECKOUT_WAIT_SECONDS = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a pooled database connection.',
+)
+SERIALIZATION_SECONDS = Histogram(
+    'serialization_duration_seconds',
+    'Time spent serializing responses, per marshmallow schema, JSON encoding or serializer.',
+    ['serializer'],
+)
+
+# Set while a schema dumps, nested schemas are accounted to the outer one
+_dumping: ContextVar[bool] = ContextVar('dumping', default=False)
+
+
+class TimedSchema(Schema):
+    """Schema recording the time spent in `dump`."""
+
+    def dump(self, obj, *, many=None):
+        if _dumping.get():
+            return super().dump(obj, many=many)
+
+        token = _dumping.set(True)
+        start = perf_counter()
+        try:
+            return super().dump(obj, many=many)
+        finally:
+            SERIALIZATION_SECONDS.labels(type(self).__name__).observe(perf_counter() - start)
+            _dumping.reset(token)
+
+
+@contextmanager
+def timed_serialization(serializer: str):
+    """Record the time spent serializing with a custom serializer."""
+
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        SERIALIZATION_SECONDS.labels(serializer).observe(perf_counter() - start)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider recording the time spent encoding."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        start = perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            SERIALIZATION_SECONDS.labels('json').observe(perf_counter() - start)
+
+
+def current_route() -> str:
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return 'none'
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['query_start'].pop()
+
+    SQL_STATEMENT_SECONDS.labels(current_route()).observe(elapsed)
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # Failed statements never reach `after_cursor_execute`, drop their start
+    if exception_context.connection is not None and (
+        starts := exception_context.connection.info.get('query_start')
+    ):
+        starts.pop()
+
+
+TimedQueuePool.wait_listeners.append(POOL_CHECKOUT_WAIT_SECONDS.observe)
+
+
+def _start_timer():
+    g.request_start = perf_counter()
+
+
+def _observe_request(response):
+    route = current_route()
+    REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(
+        perf_counter() - g.request_start
+    )
+    SQL_REQUEST_STATEMENTS.labels(route).observe(g.get('sql_statements', 0))
+    SQL_REQUEST_SECONDS.labels(route).observe(g.get('sql_seconds', 0.0))
+    return response
+
+
+def metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        data = generate_latest(registry)
+    else:
+        data = generate_latest()
+    return Response(data, mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app: Flask):
+    """Instrument the requests of `app` and serve the metrics on `/metrics`."""
+
+    app.json = TimedJSONProvider(app)
+    app.before_request(_start_timer)
+    app.after_request(_observe_request)
+    app.add_url_rule('/metrics', view_func=metrics)
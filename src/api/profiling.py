@@ -0,0 +1,137 @@
+"""
+Opt-in request profiling and slow query log.
+
+When `PROFILING_ENABLED` is set, a request sent with an `X-Profile` header runs
+under `cProfile`. Its report is stored as JSON in `PROFILE_DIR`, named after
+the `X-Profile-Id` response header. The report holds the wall time, the
+profile, and every SQL statement issued along with its duration. Reads also
+carry their `EXPLAIN (ANALYZE, BUFFERS)` plan.
+
+Independently, statements running longer than `SLOW_QUERY_THRESHOLD`
+milliseconds are logged along with the route issuing them.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import uuid
+from logging import getLogger
+from time import perf_counter
+
+from flask import Flask
+from flask import g
+from flask import has_request_context
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from api.metrics import current_route
+from config import PROFILE_DIR
+from config import PROFILING_ENABLED
+from config import SLOW_QUERY_THRESHOLD
+
+logger = getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile'
+# Functions listed in a report, by cumulative time
+PROFILE_FUNCTIONS = 50
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profiling_start', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info['profiling_start'].pop()
+
+    if SLOW_QUERY_THRESHOLD and elapsed * 1000 >= SLOW_QUERY_THRESHOLD:
+        logger.warning(
+            'Slow query, %.1fms on route %s: %s', elapsed * 1000, current_route(), statement
+        )
+
+    if has_request_context() and (profile := g.get('profile')) is not None:
+        profile['statements'].append(
+            (conn.engine, statement, None if executemany else parameters, elapsed)
+        )
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # Failed statements never reach `after_cursor_execute`, drop their start
+    if exception_context.connection is not None and (
+        starts := exception_context.connection.info.get('profiling_start')
+    ):
+        starts.pop()
+
+
+def _explain(engine, statement: str, parameters) -> list[str] | None:
+    """Return the plan of a read statement, None for anything else."""
+
+    if parameters is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+
+    # Plans are analyzed by running the statement again, never do so for a write
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters)
+        plan = [row[0] for row in rows]
+        conn.rollback()
+
+    return plan
+
+
+def _start_profile():
+    if not PROFILING_ENABLED or PROFILE_HEADER not in request.headers:
+        return
+
+    profiler = cProfile.Profile()
+    g.profile = {'profiler': profiler, 'statements': [], 'start': perf_counter()}
+    profiler.enable()
+
+
+def _store_profile(response):
+    if (profile := g.pop('profile', None)) is None:
+        return response
+
+    profile['profiler'].disable()
+    wall_time = perf_counter() - profile['start']
+
+    stats = io.StringIO()
+    pstats.Stats(profile['profiler'], stream=stats).sort_stats('cumulative').print_stats(
+        PROFILE_FUNCTIONS
+    )
+
+    report = {
+        'method': request.method,
+        'path': request.full_path,
+        'route': current_route(),
+        'status': response.status_code,
+        'wall_time': wall_time,
+        'statements': [
+            {
+                'statement': statement,
+                'duration': duration,
+                'plan': _explain(engine, statement, parameters),
+            }
+            for engine, statement, parameters, duration in profile['statements']
+        ],
+        'profile': stats.getvalue(),
+    }
+
+    profile_id = uuid.uuid4().hex
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f'{profile_id}.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def init_app(app: Flask):
+    """Profile the requests of `app` asking for it, when enabled."""
+
+    app.before_request(_start_profile)
+    app.after_request(_store_profile)
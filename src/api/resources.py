@@ -1,6 +1,15 @@
+import json
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from hashlib import blake2b
+
+import numpy as np
 from flask import Blueprint
+from flask import Response
+from flask import current_app
 from flask import jsonify
 from flask import request
+from flask import stream_with_context
 from marshmallow import EXCLUDE
 from marshmallow import Schema
 from marshmallow import ValidationError
@@ -8,30 +17,83 @@ from marshmallow import fields as maf
 from marshmallow import post_load
 from marshmallow import pre_load
 from marshmallow import validate as mav
-from sqlalchemy import and_
+from marshmallow import validates_schema
 from sqlalchemy import asc
+from sqlalchemy import delete
 from sqlalchemy import desc
 from sqlalchemy import exists
+from sqlalchemy import func
+from sqlalchemy import insert
 from sqlalchemy import select
 from sqlalchemy import text
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import raiseload
 from sqlalchemy.orm import selectinload
 
+import assignment
+from api.metrics import TimedSchema
+from api.metrics import timed_serialization
+from api.serialization import experiments_json
+from api.serialization import listing_json
+from api.serialization import team_json
+from config import LISTING_CACHE_SIZE
+from config import LISTING_TOTAL_ESTIMATE_THRESHOLD
+from db.cache import LRUCache
 from db.db_models import Experiment
 from db.db_models import Team
-from db.db_models import experiment_teams_cte
+from db.db_models import experiments_teams
+from db.db_models import get_data_versions
 from db.db_models import get_session
+from db.db_models import get_team_tree
+from db.db_models import lock_team_moves
+from db.db_models import paths_related
+from db.db_models import set_read_only
+from db.db_models import team_closure
+from db.db_models import team_stats
+from db.team_tree import TeamTree
+from snapshot import latest_snapshot
 
 bp = Blueprint('rec_task_resources', __name__, url_prefix='')
 
+# Rows fetched per server side cursor round trip when exporting
+EXPORT_BATCH_SIZE = 1000
+# Max number of experiments created by a single batch request
+BATCH_MAX_SIZE = 10000
+
+# Loader strategy for experiments dumped with `ExperimentSchema`: only teams are
+# needed, any other lazy load is a bug and raises instead of silently querying.
+EXPERIMENT_LOADER_OPTIONS = (selectinload(Experiment.teams).raiseload('*'), raiseload('*'))
+
+# Serialized listing pages, keyed by their ETag
+listing_cache: LRUCache[bytes] = LRUCache(LISTING_CACHE_SIZE)
+
+
+# Methods of requests never writing, their reads are served by the replica
+READ_ONLY_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+def read_only(view):
+    """Mark a view not using a read-only method as never writing."""
+
+    view.read_only = True
+    return view
+
+
+@bp.before_request
+def route_reads():
+    view = current_app.view_functions.get(request.endpoint)
+    set_read_only(request.method in READ_ONLY_METHODS or getattr(view, 'read_only', False))
 
-class TeamSchema(Schema):
+
+class TeamSchema(TimedSchema):
     id = maf.Integer()
     name = maf.String(required=True)
     experiments = maf.Nested("ExperimentSchema", many=True, dump_only=True, exclude=['teams'])
     parent_team_id = maf.Integer(load_only=True)
 
 
-class ExperimentSchema(Schema):
+class ExperimentSchema(TimedSchema):
     id = maf.Integer()
     description = maf.String(required=True)
     sample_ratio = maf.Integer(required=True)
@@ -39,6 +101,12 @@ class ExperimentSchema(Schema):
     team_ids = maf.List(maf.Integer(), load_only=True, required=True, validate=mav.Length(1, 2))
 
 
+class ExperimentBatchSchema(Schema):
+    experiments = maf.List(
+        maf.Nested(ExperimentSchema), required=True, validate=mav.Length(1, BATCH_MAX_SIZE)
+    )
+
+
 class ExperimentUpdateSchema(Schema):
     # Ideally we would re-user the existing schema, but we're aiming
     # for a simple setup therefore we're unable to re-user and exclude
@@ -47,11 +115,124 @@ class ExperimentUpdateSchema(Schema):
     team_ids = maf.List(maf.Integer(), required=True, validate=mav.Length(1, 2))
 
 
+class UnitId(maf.Field):
+    """Unit identifier, either an integer or a string."""
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValidationError('Not a valid unit id.')
+        return value
+
+
+class AssignmentSchema(Schema):
+    unit_id = UnitId(required=True)
+
+
+def encode_cursor(payload: dict) -> str:
+    return urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+
+class Cursor(maf.Field):
+    """Opaque keyset pagination cursor."""
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return json.loads(urlsafe_b64decode(value.encode()))
+        except (ValueError, TypeError) as ex:
+            raise ValidationError('Invalid cursor.') from ex
+
+
+# Keyset pagination of the listings, in (sort column, id) order. A cursor
+# holds the key of the last row of a page, the next page seeks past it.
+
+
+def keyset_order(query, sort_column, id_column, filters: dict):
+    """Order `query` by the sort column of the listing, ties broken by id."""
+
+    order_by_func = asc if filters['order_by'] == 'asc' else desc
+
+    query = query.order_by(order_by_func(sort_column))
+    if sort_column is not id_column:
+        query = query.order_by(order_by_func(id_column))
+
+    return query
+
+
+def keyset_cursor_valid(key, sort_column, id_column) -> bool:
+    """Whether `key` has the types of the columns, it is seeked on them."""
+
+    return (
+        isinstance(key, list)
+        and len(key) == 2
+        and all(
+            # `type` and not `isinstance`, booleans are not valid ints
+            type(value) is column.type.python_type
+            for value, column in zip(key, (sort_column, id_column))
+        )
+    )
+
+
+def keyset_page(query, sort_column, id_column, filters: dict):
+    """Limit `query` to the page of the listing, past its cursor or at its page offset."""
+
+    query = query.limit(filters['limit'])
+
+    if cursor := filters.pop('cursor', None):
+        key = tuple_(sort_column, id_column)
+        last_key = tuple_(*cursor['key'])
+        return query.where(key > last_key if filters['order_by'] == 'asc' else key < last_key)
+
+    return query.offset(filters['page'] * filters['limit'])
+
+
+def keyset_next_cursor(rows, sort_column, id_column, filters: dict) -> str | None:
+    """Return the cursor of the page after `rows`, none when it is the last page."""
+
+    if len(rows) < filters['limit']:
+        return None
+
+    return encode_cursor(
+        {
+            "sort_by": filters['sort_by'],
+            "order_by": filters['order_by'],
+            "key": [getattr(rows[-1], sort_column.key), getattr(rows[-1], id_column.key)],
+        }
+    )
+
+
+class ExperimentTeamsAssignmentSchema(ExperimentUpdateSchema):
+    experiment_id = maf.Integer(required=True)
+
+
+class TeamReplacementSchema(Schema):
+    team_id = maf.Integer(required=True)
+    with_team_id = maf.Integer(required=True)
+
+
+class ExperimentTeamsPatchSchema(Schema):
+    assignments = maf.List(
+        maf.Nested(ExperimentTeamsAssignmentSchema), validate=mav.Length(1, BATCH_MAX_SIZE)
+    )
+    replace = maf.Nested(TeamReplacementSchema)
+
+    @validates_schema
+    def validate_operation(self, data, **kwargs):
+        if ('assignments' in data) == ('replace' in data):
+            raise ValidationError('Exactly one of `assignments` or `replace` is required.')
+        experiment_ids = [a['experiment_id'] for a in data.get('assignments', [])]
+        if len(experiment_ids) != len(set(experiment_ids)):
+            raise ValidationError('Experiments can only be assigned once.', 'assignments')
+
+
 class BaseQueryArgsSchema(Schema):
     page = maf.Integer(load_default=0)
     limit = maf.Integer(load_default=25)
     order_by = maf.String(load_default='asc', validate=mav.OneOf(('asc', 'desc')))
     sort_by = maf.String()
+    cursor = Cursor()
+
+    # Model listed, its columns are the ones of the cursor keys
+    model = None
 
     @post_load
     def normalize_qas(self, data, **kwargs):
@@ -61,58 +242,251 @@ class BaseQueryArgsSchema(Schema):
             data['page'] -= 1
         return data
 
+    @post_load
+    def validate_cursor(self, data, **kwargs):
+        # A cursor is only meaningful for the ordering it was issued for
+        if (cursor := data.get('cursor')) is not None:
+            if not (
+                isinstance(cursor, dict)
+                and cursor.get('sort_by') == data.get('sort_by')
+                and cursor.get('order_by') == data['order_by']
+                and keyset_cursor_valid(
+                    cursor.get('key'), getattr(self.model, data['sort_by']), self.model.id
+                )
+            ):
+                raise ValidationError('Invalid cursor.', 'cursor')
+        return data
+
 
 class ExperimentListQAS(BaseQueryArgsSchema):
     sort_by = maf.String(validate=mav.OneOf(('id', 'sample_ratio')), load_default='id')
+    with_total = maf.Boolean()
+
+    model = Experiment
 
     class Meta:
         unknown = EXCLUDE
 
 
+class TeamUpdateSchema(Schema):
+    parent_team_id = maf.Integer(required=True, allow_none=True)
+
+
+class TeamListQAS(BaseQueryArgsSchema):
+    sort_by = maf.String(validate=mav.OneOf(('id', 'name')), load_default='id')
+
+    model = Team
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class TeamSubtreeQAS(Schema):
+    max_depth = maf.Integer(validate=mav.Range(min=0))
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+class SnapshotQAS(Schema):
+    since_version = maf.Integer()
+
+    class Meta:
+        unknown = EXCLUDE
+
+
+def load_experiment_filters(args) -> dict:
+    filters = ExperimentListQAS().load(args)
+    # For a quick and dirty way to deserialize lists
+    if team_ids := args.getlist("team_ids[]"):
+        try:
+            filters['team_ids[]'] = [int(tid) for tid in team_ids]
+        except ValueError as ex:
+            raise ValidationError(str(ex), 'team_ids[]') from ex
+    return filters
+
+
+def experiment_teams_error(team_ids, paths: dict[int, list[int]]) -> str | None:
+    """
+    Return why an experiment cannot have these teams, None when it can.
+
+    Shared by every write of experiment teams, `paths` maps the ids of the
+    teams found to their `Team.path`, ancestry checks never query.
+    """
+
+    if len({tid for tid in team_ids if tid in paths}) != len(team_ids):
+        return 'Some/All of the teams specified were not found'
+    if paths_related(paths[tid] for tid in team_ids):
+        return 'Experiment teams cannot be descendents of one another'
+    return None
+
+
+def experiment_list_query(filters: dict, team_tree: TeamTree | None = None):
+    """Select the experiments matching the listing filters, in listing order."""
+
+    query = keyset_order(
+        select(Experiment), getattr(Experiment, filters['sort_by']), Experiment.id, filters
+    )
+
+    if team_ids := filters.get('team_ids[]'):
+        query = query.where(
+            Experiment.team_ids.overlap(
+                team_ids + (team_tree or get_team_tree()).sub_teams(team_ids)
+            )
+        )
+
+    return query
+
+
+def count_experiments(
+    session, filters: dict, team_tree: TeamTree | None = None
+) -> tuple[int, bool]:
+    """
+    Return the number of experiments matching the filters, and whether it is an estimate.
+
+    Team filtered counts are exact, they only read the GIN index of
+    `Experiment.team_ids`. Unfiltered ones use the planner's estimate of the
+    table size, unless it is below `LISTING_TOTAL_ESTIMATE_THRESHOLD`.
+    """
+
+    if not filters.get('team_ids[]'):
+        estimate = session.scalar(
+            text("SELECT reltuples FROM pg_class WHERE oid = 'experiment'::regclass")
+        )
+        # -1 until the table is first analyzed
+        if estimate is not None and estimate >= LISTING_TOTAL_ESTIMATE_THRESHOLD:
+            return int(estimate), True
+
+    query = (
+        experiment_list_query(filters, team_tree)
+        .with_only_columns(func.count(), maintain_column_froms=True)
+        .order_by(None)
+    )
+
+    return session.scalar(query), False
+
+
+def listing_body(app, body: bytes) -> bytes:
+    """
+    Return a listing body as sent by `app`.
+
+    In debug mode Flask indents its JSON responses, the compact body of
+    `list_experiments` is then encoded again the same way.
+    """
+
+    if app.debug:
+        return app.json.response(json.loads(body)).get_data()
+    return body
+
+
+def listing_etag(versions: tuple[int, ...], filters: dict) -> str:
+    return blake2b(
+        json.dumps([versions, filters], sort_keys=True).encode(), digest_size=16
+    ).hexdigest()
+
+
+def list_experiments(session, filters: dict, team_tree: TeamTree | None = None) -> str:
+    """
+    Return the JSON body of the listing page matching the filters.
+
+    Rows are projected and serialized by `api.serialization`, the body is the
+    same as `ExperimentSchema` data encoded by the app JSON provider.
+    """
+
+    sort_column = getattr(Experiment, filters['sort_by'])
+
+    query = keyset_page(
+        experiment_list_query(filters, team_tree).with_only_columns(
+            Experiment.id, Experiment.description, Experiment.sample_ratio, Experiment.team_ids
+        ),
+        sort_column,
+        Experiment.id,
+        filters,
+    )
+
+    rows = session.execute(query).all()
+    total = count_experiments(session, filters, team_tree) if filters.get('with_total') else None
+
+    with timed_serialization('experiment_listing'):
+        teams = {}
+        if team_ids := {team_id for row in rows for team_id in row.team_ids}:
+            teams = {
+                team_id: team_json(team_id, name)
+                for team_id, name in session.execute(
+                    select(Team.id, Team.name).where(Team.id.in_(team_ids))
+                )
+            }
+        data = experiments_json(rows, teams)
+
+        meta = {
+            **filters,
+            "items": len(rows),
+            "page": filters['page'] + 1,
+            "next_cursor": keyset_next_cursor(rows, sort_column, Experiment.id, filters),
+        }
+
+        if total is not None:
+            meta['total'], meta['total_estimated'] = total
+
+        return listing_json(data, meta)
+
+
 @bp.route("/experiments")
 def get_experiments():
     """List experiments."""
 
-    session = get_session()
+    try:
+        filters = load_experiment_filters(request.args)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    # Listings only change along with experiments or the team hierarchy
+    etag = listing_etag(get_data_versions('experiments', 'team_tree'), filters)
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if (body := listing_cache.get(etag)) is None:
+        body = list_experiments(get_session(), filters).encode()
+        listing_cache.put(etag, body)
+
+    response = Response(listing_body(current_app, body), mimetype=current_app.json.mimetype)
+    response.set_etag(etag)
+
+    return response
+
+
+@bp.route("/experiments/export")
+def export_experiments():
+    """
+    Export all matching experiments as newline delimited JSON.
+
+    Rows are read through a server side cursor and streamed as they are
+    serialized, so memory use does not depend on the size of the export.
+    """
 
     try:
-        filters = ExperimentListQAS().load(request.args)
-        # For a quick and dirty way to deserialize lists
-        if team_ids := request.args.getlist("team_ids[]"):
-            try:
-                team_ids = [int(tid) for tid in team_ids]
-                filters['team_ids[]'] = team_ids
-            except ValueError as ex:
-                return ValidationError(str(ex))
+        filters = load_experiment_filters(request.args)
     except ValidationError as err:
         return jsonify(err.messages), 400
 
-    order_by_func = asc if filters['order_by'] == 'asc' else desc
+    session = get_session()
 
     query = (
-        select(Experiment)
-        .offset(filters['page'] * filters['limit'])
-        .limit(filters['limit'])
-        .order_by(order_by_func(text(f"{filters['sort_by']}")))
-        .options(selectinload(Experiment.teams))
+        experiment_list_query(filters)
+        .options(*EXPERIMENT_LOADER_OPTIONS)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
     )
 
-    if team_ids:
+    @stream_with_context
+    def generate():
+        schema = ExperimentSchema()
+        for experiment in session.execute(query).scalars():
+            yield current_app.json.dumps(schema.dump(experiment)) + "\n"
 
-        query = query.join(
-            experiment_teams_cte,
-            and_(
-                experiment_teams_cte.c.team_ids.op("&&")(
-                    team_ids + Team.get_all_sub_teams(tuple(team_ids))
-                ),
-                experiment_teams_cte.c.experiment_id == Experiment.id,
-            ),
-        )
-
-    data = ExperimentSchema(many=True).dump(session.execute(query).scalars())
-    meta = {**filters, "items": len(data), "page": filters['page'] + 1}
-
-    return {"data": data, "meta": meta}
+    return Response(generate(), mimetype='application/x-ndjson')
 
 
 @bp.route("/experiments", methods=["POST"])
@@ -124,19 +498,166 @@ def create_experiment():
 
     db_session = get_session()
 
+    lock_team_moves(shared=True)
     teams = db_session.execute(select(Team).where(Team.id.in_(item['team_ids']))).scalars().all()
 
-    if len(teams) != len(item['team_ids']):
-        return jsonify('Some/All of the teams specified were not found'), 400
+    if error := experiment_teams_error(item['team_ids'], {team.id: team.path for team in teams}):
+        return jsonify(error), 400
 
     experiment = Experiment(
         description=item['description'], sample_ratio=item['sample_ratio'], teams=teams
     )
 
     db_session.add(experiment)
+    db_session.flush()
+    # dump before committing, committing expires everything loaded so far
+    data = ExperimentSchema().dump(experiment)
+    db_session.commit()
+
+    return data, 201
+
+
+@bp.route("/experiments:batch", methods=["POST"])
+def create_experiments_batch():
+    """
+    Create many experiments at once.
+
+    Either all experiments are created or none, errors are reported
+    per experiment, keyed by their position in the payload.
+    """
+
+    try:
+        items = ExperimentBatchSchema().load(request.json)['experiments']
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    db_session = get_session()
+
+    lock_team_moves(shared=True)
+    all_team_ids = {tid for item in items for tid in item['team_ids']}
+    teams = {
+        team.id: team
+        for team in db_session.execute(select(Team).where(Team.id.in_(all_team_ids))).scalars()
+    }
+    paths = {team_id: team.path for team_id, team in teams.items()}
+
+    errors = {}
+    for idx, item in enumerate(items):
+        if error := experiment_teams_error(item['team_ids'], paths):
+            errors[idx] = {'team_ids': [error]}
+
+    if errors:
+        return jsonify({'experiments': errors}), 400
+
+    experiment_ids = db_session.scalars(
+        insert(Experiment).returning(Experiment.id, sort_by_parameter_order=True),
+        [
+            {'description': item['description'], 'sample_ratio': item['sample_ratio']}
+            for item in items
+        ],
+    ).all()
+    db_session.execute(
+        insert(experiments_teams),
+        [
+            {'experiment_id': experiment_id, 'team_id': tid}
+            for experiment_id, item in zip(experiment_ids, items)
+            for tid in item['team_ids']
+        ],
+    )
+
+    data = ExperimentSchema(many=True).dump(
+        [
+            {
+                'id': experiment_id,
+                'description': item['description'],
+                'sample_ratio': item['sample_ratio'],
+                'teams': [teams[tid] for tid in item['team_ids']],
+            }
+            for experiment_id, item in zip(experiment_ids, items)
+        ]
+    )
+
     db_session.commit()
 
-    return ExperimentSchema().dump(experiment), 201
+    return {"data": data}, 201
+
+
+@bp.route("/experiments:assign", methods=["POST"])
+@read_only
+def assign_experiments():
+    """
+    Assign many units to many experiments at once.
+
+    The body holds the unit ids as little-endian int64, the experiments are
+    given as `experiment_ids[]`. Responds with the `assignment.assign_many`
+    matrix as raw uint8 bytes, one row per experiment in request order and
+    one column per unit.
+    """
+
+    try:
+        experiment_ids = [int(eid) for eid in request.args.getlist("experiment_ids[]")]
+    except ValueError as ex:
+        return jsonify({'experiment_ids[]': [str(ex)]}), 400
+    if not experiment_ids:
+        return jsonify({'experiment_ids[]': ['Missing data for required field.']}), 400
+
+    body = request.get_data()
+    if len(body) % 8:
+        return jsonify('Body must be a sequence of little-endian int64 unit ids'), 400
+    unit_ids = np.frombuffer(body, dtype='<i8')
+
+    session = get_session()
+
+    sample_ratios = dict(
+        session.execute(
+            select(Experiment.id, Experiment.sample_ratio).where(Experiment.id.in_(experiment_ids))
+        ).all()
+    )
+    if missing := [eid for eid in experiment_ids if eid not in sample_ratios]:
+        return (
+            jsonify({'experiment_ids[]': {eid: 'Experiment not found!' for eid in missing}}),
+            404,
+        )
+
+    matrix = assignment.assign_many(
+        [(eid, sample_ratios[eid]) for eid in experiment_ids], unit_ids
+    )
+
+    return Response(
+        matrix.tobytes(),
+        mimetype='application/octet-stream',
+        headers={
+            'X-Experiment-Ids': ','.join(map(str, experiment_ids)),
+            'X-Units': str(len(unit_ids)),
+            'X-Variants': ','.join(assignment.VARIANTS),
+        },
+    )
+
+
+@bp.route("/experiments/<int:experiment_id>/assign", methods=["POST"])
+@read_only
+def assign_experiment(experiment_id: int):
+    """Return the variant of the experiment a unit is assigned to."""
+
+    try:
+        item = AssignmentSchema().load(request.json)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    session = get_session()
+
+    sample_ratio = session.scalar(
+        select(Experiment.sample_ratio).where(Experiment.id == experiment_id)
+    )
+    if sample_ratio is None:
+        return jsonify("Experiment not found!"), 404
+
+    return {
+        "experiment_id": experiment_id,
+        "unit_id": item['unit_id'],
+        "bucket": assignment.bucket(experiment_id, item['unit_id']),
+        "variant": assignment.assign(experiment_id, sample_ratio, item['unit_id']),
+    }
 
 
 @bp.route("/experiments/<int:experiment_id>", methods=["PUT"])
@@ -154,7 +675,9 @@ def update_experiment(experiment_id: int):
 
     session = get_session()
 
-    experiment = session.get(Experiment, experiment_id)
+    # Before any team is loaded, their paths must be the ones left by moves
+    lock_team_moves(shared=True)
+    experiment = session.get(Experiment, experiment_id, options=EXPERIMENT_LOADER_OPTIONS)
     if not experiment:
         return jsonify("Experiment not found!"), 404
     new_teams = {tid for tid in item["team_ids"]}
@@ -165,21 +688,124 @@ def update_experiment(experiment_id: int):
         return jsonify("Nothing to update"), 200
 
     new_team_set = session.execute(select(Team).where(Team.id.in_(new_teams))).scalars().all()
-    if len(new_team_set) != len(new_teams):
-        return jsonify('Some/All of the teams specified were not found'), 400
-
-    if len(new_teams) > 1:
-        # make sure new teams are not descendents of one another
-        all_descendents = Team.get_all_sub_teams(tuple(new_teams))
-        if any(nt in all_descendents for nt in new_teams):
-            # One of our new teams is showing up in the children of the other
-            return jsonify('Experiment teams cannot be descendents of one another'), 400
+    if error := experiment_teams_error(new_teams, {team.id: team.path for team in new_team_set}):
+        return jsonify(error), 400
 
     experiment.teams = new_team_set
     session.flush()
+    data = ExperimentSchema().dump(experiment)
+    session.commit()
+
+    return data
+
+
+@bp.route("/experiments/teams", methods=["PATCH"])
+def update_experiments_teams():
+    """
+    Reassign the teams of many experiments at once.
+
+    Takes either explicit `assignments` ({experiment_id, team_ids}) or a
+    `replace` operation moving every experiment of a team to another one.
+    The same rules as updating a single experiment apply, either all
+    experiments are updated or none, errors are keyed by experiment id.
+    """
+
+    try:
+        item = ExperimentTeamsPatchSchema().load(request.json)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    session = get_session()
+
+    if replace := item.get('replace'):
+        team_id, with_team_id = replace['team_id'], replace['with_team_id']
+        current = dict(
+            session.execute(
+                select(Experiment.id, Experiment.team_ids).where(
+                    Experiment.team_ids.contains([team_id])
+                )
+            ).all()
+        )
+        assignments = {
+            experiment_id: {with_team_id if tid == team_id else tid for tid in team_ids}
+            for experiment_id, team_ids in current.items()
+        }
+    else:
+        assignments = {a['experiment_id']: set(a['team_ids']) for a in item['assignments']}
+        current = dict(
+            session.execute(
+                select(Experiment.id, Experiment.team_ids).where(Experiment.id.in_(assignments))
+            ).all()
+        )
+
+    lock_team_moves(shared=True)
+    all_team_ids = {tid for team_ids in assignments.values() for tid in team_ids}
+    paths = dict(
+        session.execute(select(Team.id, Team.path).where(Team.id.in_(all_team_ids))).all()
+    )
+
+    errors = {}
+    for experiment_id, new_teams in assignments.items():
+        if experiment_id not in current:
+            errors[experiment_id] = 'Experiment not found!'
+        elif len(new_teams) != len(current[experiment_id]):
+            errors[experiment_id] = 'Cannot change number of linked teams now'
+        elif error := experiment_teams_error(new_teams, paths):
+            errors[experiment_id] = error
+
+    if errors:
+        return jsonify({'experiments': errors}), 400
+
+    changed = {
+        experiment_id: new_teams
+        for experiment_id, new_teams in assignments.items()
+        if new_teams != set(current[experiment_id])
+    }
+
+    if changed:
+        session.execute(
+            delete(experiments_teams).where(experiments_teams.c.experiment_id.in_(changed))
+        )
+        session.execute(
+            insert(experiments_teams),
+            [
+                {'experiment_id': experiment_id, 'team_id': tid}
+                for experiment_id, new_teams in changed.items()
+                for tid in new_teams
+            ],
+        )
     session.commit()
 
-    return ExperimentSchema().dump(experiment)
+    experiments = session.scalars(
+        select(Experiment)
+        .where(Experiment.id.in_(changed))
+        .order_by(Experiment.id)
+        .options(*EXPERIMENT_LOADER_OPTIONS)
+    )
+
+    return {"data": ExperimentSchema(many=True).dump(experiments)}
+
+
+@bp.route("/snapshot")
+def get_snapshot():
+    """
+    Download the experiment configuration snapshot, see `snapshot`.
+
+    Answers 304 when the client's `since_version` is still current.
+    """
+
+    try:
+        args = SnapshotQAS().load(request.args)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    version, data = latest_snapshot()
+    headers = {'X-Snapshot-Version': str(version)}
+
+    if args.get('since_version') == version:
+        return Response(status=304, headers=headers)
+
+    return Response(data, mimetype='application/octet-stream', headers=headers)
 
 
 @bp.route("/teams", methods=["POST"])
@@ -191,17 +817,214 @@ def create_team():
 
     db_session = get_session()
 
-    if db_session.execute(select(exists().where(Team.name == item['name']))).scalar():
-        return jsonify('Team already exists'), 400
-
-    team = Team(name=item['name'])
+    # a new team has no experiments, no need to ever load them
+    team = Team(name=item['name'], experiments=[])
 
     if parent_id := item.get("parent_team_id"):
-        if (parent := db_session.get(Team, parent_id)) is None:
+        if (parent := db_session.get(Team, parent_id, options=[raiseload('*')])) is None:
             return jsonify("Specified parent not found"), 404
         team.parent_team_id = parent.id
 
     db_session.add(team)
+    try:
+        db_session.flush()
+    except IntegrityError as err:
+        db_session.rollback()
+        # Names are unique, the constraint is the check
+        if err.orig.diag.constraint_name == 'uq_team_name':
+            return jsonify('Team already exists'), 400
+        raise
+    data = TeamSchema().dump(team)
     db_session.commit()
 
-    return TeamSchema().dump(team), 201
+    return data, 201
+
+
+@bp.route("/teams/<int:team_id>", methods=["PATCH"])
+def update_team(team_id: int):
+    """
+    Move a team, along with its whole subtree, below another parent.
+
+    A null `parent_team_id` makes it a top-level team. The move is refused if
+    it would put the team below itself, or make the teams of an experiment
+    descendants of one another. The team closure, the team stats and the
+    data versions follow through their triggers.
+    """
+
+    try:
+        item = TeamUpdateSchema().load(request.json)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    session = get_session()
+
+    # Taken before the checks, they see the hierarchy left by the previous move
+    lock_team_moves()
+
+    team = session.get(Team, team_id, options=[raiseload('*')])
+    if team is None:
+        return jsonify("Team not found!"), 404
+
+    parent_id = item['parent_team_id']
+    if parent_id == team.parent_team_id:
+        return jsonify("Nothing to update"), 200
+
+    if parent_id is not None:
+        if session.get(Team, parent_id, options=[raiseload('*')]) is None:
+            return jsonify("Specified parent not found"), 404
+
+        # The parent must not be in the subtree, a single closure lookup
+        if session.scalar(
+            select(
+                exists().where(
+                    team_closure.c.ancestor_id == team_id,
+                    team_closure.c.descendant_id == parent_id,
+                )
+            )
+        ):
+            return jsonify('A team cannot be moved below itself or its descendants'), 400
+
+        # Experiments with a team in the subtree and another one among the
+        # new ancestors, parent included, would end up with related teams
+        moved, other = experiments_teams.alias('moved'), experiments_teams.alias('other')
+        sub, ancestors = team_closure.alias('sub'), team_closure.alias('ancestors')
+        conflicts = session.scalars(
+            select(moved.c.experiment_id)
+            .distinct()
+            .join(sub, sub.c.descendant_id == moved.c.team_id)
+            .join(other, other.c.experiment_id == moved.c.experiment_id)
+            .join(ancestors, ancestors.c.ancestor_id == other.c.team_id)
+            .where(sub.c.ancestor_id == team_id, ancestors.c.descendant_id == parent_id)
+            .order_by(moved.c.experiment_id)
+        ).all()
+        if conflicts:
+            return (
+                jsonify(
+                    {
+                        'experiments': {
+                            experiment_id: 'Experiment teams cannot be descendents of one another'
+                            for experiment_id in conflicts
+                        }
+                    }
+                ),
+                400,
+            )
+
+    team.parent_team_id = parent_id
+    try:
+        session.flush()
+    except IntegrityError as err:
+        session.rollback()
+        # Moves made outside of the API are only checked by the trigger
+        if err.orig.diag.constraint_name == 'team_hierarchy_cycle':
+            return jsonify('A team cannot be moved below itself or its descendants'), 400
+        raise
+    data = {"id": team.id, "name": team.name, "parent_team_id": team.parent_team_id}
+    session.commit()
+
+    return data
+
+
+@bp.route("/teams/<int:team_id>/stats")
+def get_team_stats(team_id: int):
+    """
+    Return the experiment counts of a team.
+
+    Counts are kept up to date by the `team_stats_sync` trigger, reading them
+    is a single primary key lookup whatever the size of the subtree.
+    """
+
+    session = get_session()
+
+    stats = session.execute(
+        select(
+            func.coalesce(team_stats.c.experiments, 0),
+            func.coalesce(team_stats.c.subtree_experiments, 0),
+        )
+        .select_from(Team)
+        .outerjoin(team_stats, team_stats.c.team_id == Team.id)
+        .where(Team.id == team_id)
+    ).one_or_none()
+    if stats is None:
+        return jsonify("Team not found!"), 404
+
+    experiments, subtree_experiments = stats
+    return {
+        "team_id": team_id,
+        "experiments": experiments,
+        "subtree_experiments": subtree_experiments,
+    }
+
+
+@bp.route("/teams")
+def get_teams():
+    """List teams, flat, with their parent team."""
+
+    try:
+        filters = TeamListQAS().load(request.args)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    session = get_session()
+
+    sort_column = getattr(Team, filters['sort_by'])
+
+    query = keyset_order(
+        select(Team.id, Team.name, Team.parent_team_id), sort_column, Team.id, filters
+    )
+    rows = session.execute(keyset_page(query, sort_column, Team.id, filters)).all()
+
+    return {
+        "data": [
+            {"id": team_id, "name": name, "parent_team_id": parent_team_id}
+            for team_id, name, parent_team_id in rows
+        ],
+        "meta": {
+            **filters,
+            "items": len(rows),
+            "page": filters['page'] + 1,
+            "next_cursor": keyset_next_cursor(rows, sort_column, Team.id, filters),
+        },
+    }
+
+
+@bp.route("/teams/<int:team_id>/subtree")
+def get_team_subtree(team_id: int):
+    """
+    Return a team and its descendants as a nested tree.
+
+    The whole subtree is read in one query on the team closure, `max_depth`
+    levels below the team at most. Rows come ordered by depth so that every
+    parent is placed before its children, the tree is assembled in one pass.
+    """
+
+    try:
+        args = TeamSubtreeQAS().load(request.args)
+    except ValidationError as err:
+        return jsonify(err.messages), 400
+
+    session = get_session()
+
+    query = (
+        select(Team.id, Team.name, Team.parent_team_id)
+        .join(team_closure, team_closure.c.descendant_id == Team.id)
+        .where(team_closure.c.ancestor_id == team_id)
+        .order_by(team_closure.c.depth, Team.id)
+    )
+    if (max_depth := args.get('max_depth')) is not None:
+        query = query.where(team_closure.c.depth <= max_depth)
+
+    rows = session.execute(query).all()
+    if not rows:
+        return jsonify("Team not found!"), 404
+
+    nodes = {}
+    for node_id, name, parent_team_id in rows:
+        nodes[node_id] = node = {"id": node_id, "name": name, "children": []}
+        if node_id != team_id:
+            nodes[parent_team_id]["children"].append(node)
+
+    root = nodes[team_id]
+    root["parent_team_id"] = rows[0].parent_team_id
+
+    return {"data": root, "meta": {"max_depth": max_depth, "items": len(rows)}}
@@ -0,0 +1,48 @@
+"""
+Precompiled JSON serialization of experiment listings.
+
+Listings are the hot path: instead of loading ORM entities and dumping them
+through marshmallow, projected rows are formatted straight into JSON. The
+output is byte for byte the one of `ExperimentSchema(many=True).dump` encoded
+by Flask's default JSON provider: ASCII only, sorted keys, compact separators.
+In debug mode Flask indents its output instead, listings are then encoded
+again by `api.resources.listing_body`.
+"""
+import json
+from collections.abc import Iterable
+from functools import partial
+from json.encoder import encode_basestring_ascii as encode_string
+
+_join = ','.join
+
+# Same options as `flask.json.provider.DefaultJSONProvider`, outside of debug mode
+dumps = partial(json.dumps, ensure_ascii=True, sort_keys=True, separators=(',', ':'))
+
+
+def team_json(team_id: int, name: str) -> str:
+    """Return a team as dumped by `TeamSchema(exclude=['experiments'])`."""
+
+    return f'{{"id":{team_id},"name":{encode_string(name)}}}'
+
+
+def experiments_json(
+    rows: Iterable[tuple[int, str, int, list[int]]], teams: dict[int, str]
+) -> str:
+    """
+    Return (id, description, sample_ratio, team_ids) rows as a JSON array.
+
+    `teams` maps team ids to their `team_json`, teams are listed in the order
+    of `team_ids`.
+    """
+
+    return '[' + ','.join(
+        f'{{"description":{encode_string(description)},"id":{experiment_id}'
+        f',"sample_ratio":{sample_ratio},"teams":[{_join(map(teams.__getitem__, team_ids))}]}}'
+        for experiment_id, description, sample_ratio, team_ids in rows
+    ) + ']'
+
+
+def listing_json(data: str, meta: dict) -> str:
+    """Return the body of a listing, of `experiments_json` data."""
+
+    return f'{{"data":{data},"meta":{dumps(meta)}}}\n'
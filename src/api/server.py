@@ -0,0 +1,67 @@
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+from api.app import create_app
+from config import DATABASE_MAX_CONNECTIONS
+from config import DATABASE_MAX_OVERFLOW
+from config import DATABASE_POOL_SIZE
+from config import SERVER_HOST
+from config import SERVER_PORT
+from config import SERVER_THREADS
+from config import SERVER_TIMEOUT
+from config import SERVER_WORKERS
+from db import db_models
+
+
+class Server(BaseApplication):
+    """Pre-forking gunicorn server for an already built WSGI application."""
+
+    def __init__(self, application, options: dict):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def post_fork(server, worker):
+    # Pooled connections must never be shared across processes, drop the
+    # ones inherited from the master without closing them under its feet.
+    db_models.engine.dispose(close=False)
+    db_models.replica_engine.dispose(close=False)
+
+
+def check_database_connections(workers: int, engines: int):
+    """Exit when `workers` could open more connections to a database than it accepts."""
+
+    connections = workers * engines * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW)
+    if connections > DATABASE_MAX_CONNECTIONS:
+        sys.exit(
+            f'{workers} workers may open {connections} connections to a database, past'
+            f' DATABASE_MAX_CONNECTIONS={DATABASE_MAX_CONNECTIONS}: lower SERVER_WORKERS,'
+            ' DATABASE_POOL_SIZE or DATABASE_MAX_OVERFLOW'
+        )
+
+
+def run():
+    check_database_connections(SERVER_WORKERS, engines=1)
+
+    # The app is built once in the master and inherited by every worker
+    app = create_app()
+
+    options = {
+        'bind': f'{SERVER_HOST}:{SERVER_PORT}',
+        'workers': SERVER_WORKERS,
+        'threads': SERVER_THREADS,
+        'worker_class': 'gthread',
+        'timeout': SERVER_TIMEOUT,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }
+    Server(app, options).run()
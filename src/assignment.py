@@ -0,0 +1,100 @@
+"""
+Deterministic assignment of units (users, devices, ...) to experiments.
+
+A unit lands in one of `BUCKETS` buckets per experiment, from a stable hash
+of the experiment id and the unit id. Units whose bucket falls below the
+experiment `sample_ratio` (a percentage) are part of the experiment and
+are split evenly between its variants. No state is stored: the same unit
+always gets the same answer for the same experiment.
+"""
+from collections.abc import Sequence
+from hashlib import blake2b
+
+import numpy as np
+
+BUCKETS = 100
+VARIANTS = ('control', 'treatment')
+
+MASK64 = (1 << 64) - 1
+
+# Units hashed at once by `assign_many`, bounds its working memory
+CHUNK_SIZE = 1 << 20
+
+
+def mix64(x: int) -> int:
+    """MurmurHash3 64-bit finalizer."""
+
+    x ^= x >> 33
+    x = (x * 0xFF51AFD7ED558CCD) & MASK64
+    x ^= x >> 33
+    x = (x * 0xC4CEB9FE1A85EC53) & MASK64
+    x ^= x >> 33
+    return x
+
+
+def unit_key(unit_id: int | str) -> int:
+    """
+    Map a unit id to an unsigned 64-bit key.
+
+    Integers are used as is (two's complement for negative ones), strings
+    are hashed, so integer ids can be assigned in bulk without hashing.
+    """
+
+    if isinstance(unit_id, int):
+        return unit_id & MASK64
+    return int.from_bytes(blake2b(unit_id.encode(), digest_size=8).digest(), 'little')
+
+
+def unit_hash(experiment_id: int, unit_id: int | str) -> int:
+    return mix64(unit_key(unit_id) ^ mix64(experiment_id & MASK64))
+
+
+def bucket(experiment_id: int, unit_id: int | str) -> int:
+    """Return the bucket of a unit within an experiment."""
+
+    return unit_hash(experiment_id, unit_id) % BUCKETS
+
+
+def assign(experiment_id: int, sample_ratio: int, unit_id: int | str) -> str | None:
+    """Return the variant a unit is assigned to, None when out of the sample."""
+
+    h = unit_hash(experiment_id, unit_id)
+    if h % BUCKETS >= sample_ratio:
+        return None
+    # pick the variant from the high bits, independent of the bucket
+    return VARIANTS[(h >> 32) % len(VARIANTS)]
+
+
+def _mix64_array(x: np.ndarray) -> np.ndarray:
+    """`mix64` over an array of uint64, in place."""
+
+    x ^= x >> np.uint64(33)
+    x *= np.uint64(0xFF51AFD7ED558CCD)
+    x ^= x >> np.uint64(33)
+    x *= np.uint64(0xC4CEB9FE1A85EC53)
+    x ^= x >> np.uint64(33)
+    return x
+
+
+def assign_many(experiments: Sequence[tuple[int, int]], unit_ids: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `assign` of many integer units to many experiments.
+
+    Takes (experiment_id, sample_ratio) pairs and an array of integer unit
+    ids, returns a uint8 matrix of one row per experiment and one column
+    per unit holding 0 for units out of the sample, else 1 + the index of
+    their variant in `VARIANTS`.
+    """
+
+    unit_ids = np.asarray(unit_ids, dtype=np.int64)
+    matrix = np.zeros((len(experiments), len(unit_ids)), dtype=np.uint8)
+
+    for start in range(0, len(unit_ids), CHUNK_SIZE):
+        keys = unit_ids[start : start + CHUNK_SIZE].view(np.uint64)
+        for row, (experiment_id, sample_ratio) in enumerate(experiments):
+            h = _mix64_array(keys ^ np.uint64(mix64(experiment_id & MASK64)))
+            variants = (h >> np.uint64(32)) % np.uint64(len(VARIANTS)) + np.uint64(1)
+            in_sample = h % np.uint64(BUCKETS) < np.uint64(sample_ratio)
+            matrix[row, start : start + len(keys)] = np.where(in_sample, variants, 0)
+
+    return matrix
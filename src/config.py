@@ -1,3 +1,5 @@
+import os
+import tempfile
 from urllib.parse import quote
 
 from prettyconf import config
@@ -17,4 +19,70 @@ DATABASE_PASSWORD = config('DATABASE_PASSWORD', default='rec_task')
 DATABASE_DRIVER = 'postgresql+psycopg2'
 DATABASE_URL = f'{DATABASE_DRIVER}://{DATABASE_USER}:{quote(DATABASE_PASSWORD)}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}'  # noQA
 
+# Read replica, reads of read-only requests are sent to it when set
+DATABASE_REPLICA_HOST = config('DATABASE_REPLICA_HOST', default='')
+DATABASE_REPLICA_PORT = config('DATABASE_REPLICA_PORT', default=DATABASE_PORT)
+DATABASE_REPLICA_URL = (
+    f'{DATABASE_DRIVER}://{DATABASE_USER}:{quote(DATABASE_PASSWORD)}@{DATABASE_REPLICA_HOST}:{DATABASE_REPLICA_PORT}/{DATABASE_NAME}'  # noQA
+    if DATABASE_REPLICA_HOST
+    else None
+)
+
+# Async engine of `api.async_app`, it only reads so it prefers the replica
+DATABASE_ASYNC_DRIVER = 'postgresql+asyncpg'
+DATABASE_ASYNC_URL = (DATABASE_REPLICA_URL or DATABASE_URL).replace(
+    DATABASE_DRIVER, DATABASE_ASYNC_DRIVER, 1
+)
+
+# Connection pool, per worker process and engine. A thread holds at most one
+# connection of an engine, the default matches the default `SERVER_THREADS`.
+DATABASE_POOL_SIZE = config('DATABASE_POOL_SIZE', default=4, cast=int)
+DATABASE_MAX_OVERFLOW = config('DATABASE_MAX_OVERFLOW', default=0, cast=int)
+DATABASE_POOL_PRE_PING = config('DATABASE_POOL_PRE_PING', default='false', cast=config.boolean)
+# Seconds after which connections are recycled, -1 never recycles them
+DATABASE_POOL_RECYCLE = config('DATABASE_POOL_RECYCLE', default=-1, cast=int)
+# Connections the servers may open to a database, by default the 100 of
+# Postgres' `max_connections` less its 3 `superuser_reserved_connections`
+DATABASE_MAX_CONNECTIONS = config('DATABASE_MAX_CONNECTIONS', default=97, cast=int)
+# Milliseconds, 0 disables it
+DATABASE_STATEMENT_TIMEOUT = config('DATABASE_STATEMENT_TIMEOUT', default=0, cast=int)
+
 DEBUG = config("DEBUG", default=False, cast=bool)
+
+# Number of serialized experiment listing pages kept in memory, 0 disables it
+LISTING_CACHE_SIZE = config("LISTING_CACHE_SIZE", default=0, cast=int)
+
+# Listings asked `with_total` without a team filter count every experiment,
+# past that many the planner's row estimate is returned instead of counting
+LISTING_TOTAL_ESTIMATE_THRESHOLD = config(
+    "LISTING_TOTAL_ESTIMATE_THRESHOLD", default=100_000, cast=int
+)
+
+# Production server, see `api.server`. Its workers open up to
+#   SERVER_WORKERS * engines * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW)
+# connections to a database, checked on start against `DATABASE_MAX_CONNECTIONS`.
+# `api.server` has one engine per database, `api.async_app` two: by default
+# there are as many workers as fit two engines, up to 2 per CPU plus one.
+SERVER_HOST = config('SERVER_HOST', default='0.0.0.0')
+SERVER_PORT = config('SERVER_PORT', default=8081, cast=int)
+SERVER_WORKERS = config(
+    'SERVER_WORKERS',
+    default=max(
+        1,
+        min(
+            2 * (os.cpu_count() or 1) + 1,
+            DATABASE_MAX_CONNECTIONS // max(2 * (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW), 1),
+        ),
+    ),
+    cast=int,
+)
+SERVER_THREADS = config('SERVER_THREADS', default=4, cast=int)
+SERVER_TIMEOUT = config('SERVER_TIMEOUT', default=30, cast=int)
+
+# Requests sent with an `X-Profile` header are profiled, see `api.profiling`
+PROFILING_ENABLED = config('PROFILING_ENABLED', default='false', cast=config.boolean)
+PROFILE_DIR = config(
+    'PROFILE_DIR', default=os.path.join(tempfile.gettempdir(), 'rec_task_profiles')
+)
+# Milliseconds, statements running longer are logged, 0 disables the log
+SLOW_QUERY_THRESHOLD = config('SLOW_QUERY_THRESHOLD', default=500, cast=float)
@@ -54,7 +54,11 @@ def run_migrations_online() -> None:
 
     try:
         with context.begin_transaction():
-            # Ensure serialized migrations when multiple instance try to apply them
+            # Ensure serialized migrations when multiple instance try to apply them.
+            # The advisory lock is held by the session, past the commits of the
+            # migrations running outside of a transaction, see `autocommit_block`.
+            logger.info("Acquiring migration advisory lock")
+            connection.execute(text("SELECT pg_advisory_lock(hashtext('alembic_version'))"))
             context.get_context()._ensure_version_table()
             logger.info("Acquiring lock on `alembic_version` table")
             connection.execute(text("LOCK TABLE alembic_version IN ACCESS EXCLUSIVE MODE"))
@@ -0,0 +1,23 @@
+"""add_experiment_sample_ratio_id_index
+
+Revision ID: 1d7e93a0b6f4
+Revises: c39d0e5b71a8
+Create Date: 2026-10-18 17:12:39.246051
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '1d7e93a0b6f4'
+down_revision = 'c39d0e5b71a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_experiment_sample_ratio_id', 'experiment', ['sample_ratio', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_experiment_sample_ratio_id', table_name='experiment')
@@ -0,0 +1,64 @@
+"""serialize_team_paths
+
+Revision ID: 2c9f6a1e8d47
+Revises: 7b4e9d2a0c35
+Create Date: 2026-10-18 22:15:38.240961
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '2c9f6a1e8d47'
+down_revision = '7b4e9d2a0c35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_path_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            -- Serialized with the moves, the parent path read is not about to change
+            PERFORM pg_advisory_xact_lock(hashtext('team_closure'));
+            NEW.path := coalesce(
+                (SELECT path FROM team WHERE id = NEW.parent_team_id), '{}'
+            ) || NEW.id;
+            IF TG_OP = 'UPDATE' AND NEW.path IS DISTINCT FROM OLD.path THEN
+                -- The subtree moves along, its paths get the new prefix
+                UPDATE team
+                SET path = NEW.path || path[cardinality(OLD.path) + 1:]
+                WHERE id IN (
+                    SELECT descendant_id FROM team_closure
+                    WHERE ancestor_id = NEW.id AND depth > 0
+                );
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_path_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.path := coalesce(
+                (SELECT path FROM team WHERE id = NEW.parent_team_id), '{}'
+            ) || NEW.id;
+            IF TG_OP = 'UPDATE' AND NEW.path IS DISTINCT FROM OLD.path THEN
+                -- The subtree moves along, its paths get the new prefix
+                UPDATE team
+                SET path = NEW.path || path[cardinality(OLD.path) + 1:]
+                WHERE id IN (
+                    SELECT descendant_id FROM team_closure
+                    WHERE ancestor_id = NEW.id AND depth > 0
+                );
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
@@ -0,0 +1,71 @@
+"""add_team_path_column
+
+Revision ID: 3f8d2c5b7a61
+Revises: 6c3a8e0f1d94
+Create Date: 2026-10-18 20:17:33.904512
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3f8d2c5b7a61'
+down_revision = '6c3a8e0f1d94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'team',
+        sa.Column('path', sa.ARRAY(sa.Integer()), server_default=sa.text("'{}'"), nullable=False),
+    )
+
+    # Teams must not change between the backfill and the trigger
+    op.execute("LOCK TABLE team IN SHARE MODE")
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_path_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.path := coalesce(
+                (SELECT path FROM team WHERE id = NEW.parent_team_id), '{}'
+            ) || NEW.id;
+            IF TG_OP = 'UPDATE' AND NEW.path IS DISTINCT FROM OLD.path THEN
+                -- The subtree moves along, its paths get the new prefix
+                UPDATE team
+                SET path = NEW.path || path[cardinality(OLD.path) + 1:]
+                WHERE id IN (
+                    SELECT descendant_id FROM team_closure
+                    WHERE ancestor_id = NEW.id AND depth > 0
+                );
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_path_sync
+        BEFORE INSERT OR UPDATE OF parent_team_id ON team
+        FOR EACH ROW EXECUTE FUNCTION team_path_sync();
+        """
+    )
+
+    # Backfill the paths of the existing teams from their closure
+    op.execute(
+        """
+        UPDATE team t
+        SET path = p.path
+        FROM (
+            SELECT descendant_id, array_agg(ancestor_id ORDER BY depth DESC) AS path
+            FROM team_closure
+            GROUP BY descendant_id
+        ) p
+        WHERE t.id = p.descendant_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS team_path_sync ON team")
+    op.execute("DROP FUNCTION IF EXISTS team_path_sync()")
+    op.drop_column('team', 'path')
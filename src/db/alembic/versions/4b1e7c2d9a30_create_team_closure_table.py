@@ -0,0 +1,89 @@
+"""create_team_closure_table
+
+Revision ID: 4b1e7c2d9a30
+Revises: 313ea711456b
+Create Date: 2026-10-18 15:20:11.402187
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4b1e7c2d9a30'
+down_revision = '313ea711456b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'team_closure',
+        sa.Column('ancestor_id', sa.Integer(), nullable=False),
+        sa.Column('descendant_id', sa.Integer(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['ancestor_id'], ['team.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['descendant_id'], ['team.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+    )
+    op.create_index('ix_team_closure_descendant_id', 'team_closure', ['descendant_id'])
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_closure_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT NEW.id, NEW.id, 0
+                UNION ALL
+                SELECT ancestor_id, NEW.id, depth + 1
+                FROM team_closure
+                WHERE descendant_id = NEW.parent_team_id;
+            ELSIF NEW.parent_team_id IS DISTINCT FROM OLD.parent_team_id THEN
+                -- Detach the subtree from its former ancestors
+                DELETE FROM team_closure
+                WHERE descendant_id IN (
+                    SELECT descendant_id FROM team_closure WHERE ancestor_id = NEW.id
+                )
+                AND ancestor_id IN (
+                    SELECT ancestor_id FROM team_closure
+                    WHERE descendant_id = NEW.id AND ancestor_id != NEW.id
+                );
+                -- and attach it below the ancestors of the new parent
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT super.ancestor_id, sub.descendant_id, super.depth + sub.depth + 1
+                FROM team_closure super
+                CROSS JOIN team_closure sub
+                WHERE super.descendant_id = NEW.parent_team_id AND sub.ancestor_id = NEW.id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_closure_sync
+        AFTER INSERT OR UPDATE OF parent_team_id ON team
+        FOR EACH ROW EXECUTE FUNCTION team_closure_sync();
+        """
+    )
+
+    # Backfill the closure of the existing hierarchy
+    op.execute(
+        """
+        INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE closure AS (
+            SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth
+            FROM team
+            UNION ALL
+            SELECT c.ancestor_id, t.id, c.depth + 1
+            FROM closure c
+            JOIN team t ON t.parent_team_id = c.descendant_id
+        )
+        SELECT ancestor_id, descendant_id, depth FROM closure
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS team_closure_sync ON team")
+    op.execute("DROP FUNCTION IF EXISTS team_closure_sync()")
+    op.drop_index('ix_team_closure_descendant_id', table_name='team_closure')
+    op.drop_table('team_closure')
@@ -0,0 +1,39 @@
+"""add_experiments_data_version
+
+Revision ID: 5e0c8b27f913
+Revises: 1d7e93a0b6f4
+Create Date: 2026-10-18 18:26:52.730114
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5e0c8b27f913'
+down_revision = '1d7e93a0b6f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TRIGGER experiment_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiment
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('experiments');
+
+        CREATE TRIGGER experiments_teams_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiments_teams
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('experiments');
+        """
+    )
+
+    op.execute(
+        "INSERT INTO data_version (name, version) VALUES ('experiments', nextval('data_version_seq'))"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS experiments_teams_data_version ON experiments_teams")
+    op.execute("DROP TRIGGER IF EXISTS experiment_data_version ON experiment")
+    op.execute("DELETE FROM data_version WHERE name = 'experiments'")
@@ -0,0 +1,137 @@
+"""guard_team_moves
+
+Revision ID: 6c3a8e0f1d94
+Revises: d2b7e5a41c08
+Create Date: 2026-10-18 19:41:05.623019
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '6c3a8e0f1d94'
+down_revision = 'd2b7e5a41c08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        -- Moves a subtree out of its ancestors (-1) or into them (1), called
+        -- by `team_closure_sync`. Experiments of the subtree only count for an
+        -- ancestor through the subtree when all their links below it are there.
+        CREATE OR REPLACE FUNCTION team_stats_move(moved_team_id INT, direction INT)
+        RETURNS VOID AS $$
+        BEGIN
+            WITH moved_links AS (
+                SELECT et.experiment_id, count(*) AS links
+                FROM team_closure sub
+                JOIN experiments_teams et ON et.team_id = sub.descendant_id
+                WHERE sub.ancestor_id = moved_team_id
+                GROUP BY et.experiment_id
+            ), ancestor_links AS (
+                SELECT c.ancestor_id, m.links, count(*) AS ancestor_links
+                FROM moved_links m
+                JOIN experiments_teams et ON et.experiment_id = m.experiment_id
+                JOIN team_closure c ON c.descendant_id = et.team_id
+                JOIN team_closure a ON a.ancestor_id = c.ancestor_id
+                WHERE a.descendant_id = moved_team_id AND a.depth > 0
+                GROUP BY c.ancestor_id, m.experiment_id, m.links
+            )
+            INSERT INTO team_stats AS s (team_id, subtree_experiments)
+            SELECT ancestor_id, direction * count(*)
+            FROM ancestor_links
+            WHERE ancestor_links = links
+            GROUP BY ancestor_id
+            ON CONFLICT (team_id) DO UPDATE
+            SET subtree_experiments = s.subtree_experiments + EXCLUDED.subtree_experiments;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+    # Serialize moves, refuse cycles and move the team stats along
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_closure_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT NEW.id, NEW.id, 0
+                UNION ALL
+                SELECT ancestor_id, NEW.id, depth + 1
+                FROM team_closure
+                WHERE descendant_id = NEW.parent_team_id;
+            ELSIF NEW.parent_team_id IS DISTINCT FROM OLD.parent_team_id THEN
+                -- Moves are serialized, each one sees the hierarchy left by the previous
+                PERFORM pg_advisory_xact_lock(hashtext('team_closure'));
+                IF EXISTS (
+                    SELECT FROM team_closure
+                    WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_team_id
+                ) THEN
+                    RAISE EXCEPTION 'team % cannot be moved below team %',
+                        NEW.id, NEW.parent_team_id
+                    USING ERRCODE = 'check_violation', CONSTRAINT = 'team_hierarchy_cycle';
+                END IF;
+
+                PERFORM team_stats_move(NEW.id, -1);
+                -- Detach the subtree from its former ancestors
+                DELETE FROM team_closure
+                WHERE descendant_id IN (
+                    SELECT descendant_id FROM team_closure WHERE ancestor_id = NEW.id
+                )
+                AND ancestor_id IN (
+                    SELECT ancestor_id FROM team_closure
+                    WHERE descendant_id = NEW.id AND ancestor_id != NEW.id
+                );
+                -- and attach it below the ancestors of the new parent
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT super.ancestor_id, sub.descendant_id, super.depth + sub.depth + 1
+                FROM team_closure super
+                CROSS JOIN team_closure sub
+                WHERE super.descendant_id = NEW.parent_team_id AND sub.ancestor_id = NEW.id;
+                PERFORM team_stats_move(NEW.id, 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_closure_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT NEW.id, NEW.id, 0
+                UNION ALL
+                SELECT ancestor_id, NEW.id, depth + 1
+                FROM team_closure
+                WHERE descendant_id = NEW.parent_team_id;
+            ELSIF NEW.parent_team_id IS DISTINCT FROM OLD.parent_team_id THEN
+                -- Detach the subtree from its former ancestors
+                DELETE FROM team_closure
+                WHERE descendant_id IN (
+                    SELECT descendant_id FROM team_closure WHERE ancestor_id = NEW.id
+                )
+                AND ancestor_id IN (
+                    SELECT ancestor_id FROM team_closure
+                    WHERE descendant_id = NEW.id AND ancestor_id != NEW.id
+                );
+                -- and attach it below the ancestors of the new parent
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT super.ancestor_id, sub.descendant_id, super.depth + sub.depth + 1
+                FROM team_closure super
+                CROSS JOIN team_closure sub
+                WHERE super.descendant_id = NEW.parent_team_id AND sub.ancestor_id = NEW.id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+    op.execute("DROP FUNCTION IF EXISTS team_stats_move(INT, INT)")
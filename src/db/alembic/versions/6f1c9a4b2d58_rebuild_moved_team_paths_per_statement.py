@@ -0,0 +1,105 @@
+"""rebuild_moved_team_paths_per_statement
+
+Revision ID: 6f1c9a4b2d58
+Revises: 8d3b5f2e6a19
+Create Date: 2026-10-19 11:48:09.372516
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '6f1c9a4b2d58'
+down_revision = '8d3b5f2e6a19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_path_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            -- Serialized with the moves, the parent path read is not about to change
+            PERFORM pg_advisory_xact_lock(hashtext('team_closure'));
+            NEW.path := coalesce(
+                (SELECT path FROM team WHERE id = NEW.parent_team_id), '{}'
+            ) || NEW.id;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER team_path_sync ON team;
+        CREATE TRIGGER team_path_sync
+        BEFORE INSERT ON team
+        FOR EACH ROW EXECUTE FUNCTION team_path_sync();
+
+        -- Paths of the moved subtrees are rebuilt from the closure once the
+        -- whole statement is done, it may move many teams at once
+        CREATE OR REPLACE FUNCTION team_path_move() RETURNS TRIGGER AS $$
+        BEGIN
+            -- Also stops the recursion of its own update
+            IF NOT EXISTS (
+                SELECT FROM new_rows n JOIN old_rows o USING (id)
+                WHERE n.parent_team_id IS DISTINCT FROM o.parent_team_id
+            ) THEN
+                RETURN NULL;
+            END IF;
+
+            UPDATE team t
+            SET path = p.path
+            FROM (
+                SELECT c.descendant_id, array_agg(c.ancestor_id ORDER BY c.depth DESC) AS path
+                FROM team_closure c
+                WHERE c.descendant_id IN (
+                    SELECT sub.descendant_id
+                    FROM new_rows n
+                    JOIN old_rows o USING (id)
+                    JOIN team_closure sub ON sub.ancestor_id = n.id
+                    WHERE n.parent_team_id IS DISTINCT FROM o.parent_team_id
+                )
+                GROUP BY c.descendant_id
+            ) p
+            WHERE t.id = p.descendant_id AND t.path IS DISTINCT FROM p.path;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_path_move
+        AFTER UPDATE ON team REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_path_move();
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DROP TRIGGER team_path_move ON team;
+        DROP FUNCTION team_path_move();
+
+        CREATE OR REPLACE FUNCTION team_path_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            -- Serialized with the moves, the parent path read is not about to change
+            PERFORM pg_advisory_xact_lock(hashtext('team_closure'));
+            NEW.path := coalesce(
+                (SELECT path FROM team WHERE id = NEW.parent_team_id), '{}'
+            ) || NEW.id;
+            IF TG_OP = 'UPDATE' AND NEW.path IS DISTINCT FROM OLD.path THEN
+                -- The subtree moves along, its paths get the new prefix
+                UPDATE team
+                SET path = NEW.path || path[cardinality(OLD.path) + 1:]
+                WHERE id IN (
+                    SELECT descendant_id FROM team_closure
+                    WHERE ancestor_id = NEW.id AND depth > 0
+                );
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER team_path_sync ON team;
+        CREATE TRIGGER team_path_sync
+        BEFORE INSERT OR UPDATE OF parent_team_id ON team
+        FOR EACH ROW EXECUTE FUNCTION team_path_sync();
+        """
+    )
@@ -0,0 +1,82 @@
+"""defer_data_version_bumps
+
+Revision ID: 7b4e9d2a0c35
+Revises: 3f8d2c5b7a61
+Create Date: 2026-10-18 21:41:06.582217
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '7b4e9d2a0c35'
+down_revision = '3f8d2c5b7a61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('data_version.bumped_' || TG_ARGV[0], true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('data_version.bumped_' || TG_ARGV[0], 'on', true);
+
+            INSERT INTO data_version (name, version)
+            VALUES (TG_ARGV[0], nextval('data_version_seq'))
+            ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER experiment_data_version ON experiment;
+        CREATE CONSTRAINT TRIGGER experiment_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiment
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION bump_data_version('experiments');
+
+        DROP TRIGGER experiments_teams_data_version ON experiments_teams;
+        CREATE CONSTRAINT TRIGGER experiments_teams_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiments_teams
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION bump_data_version('experiments');
+
+        DROP TRIGGER team_tree_version ON team;
+        CREATE CONSTRAINT TRIGGER team_tree_version
+        AFTER INSERT OR DELETE OR UPDATE OF parent_team_id ON team
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION bump_data_version('team_tree');
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DROP TRIGGER team_tree_version ON team;
+        CREATE TRIGGER team_tree_version
+        AFTER INSERT OR DELETE OR UPDATE OF parent_team_id ON team
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('team_tree');
+
+        DROP TRIGGER experiments_teams_data_version ON experiments_teams;
+        CREATE TRIGGER experiments_teams_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiments_teams
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('experiments');
+
+        DROP TRIGGER experiment_data_version ON experiment;
+        CREATE TRIGGER experiment_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiment
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('experiments');
+
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO data_version (name, version)
+            VALUES (TG_ARGV[0], nextval('data_version_seq'))
+            ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
@@ -0,0 +1,57 @@
+"""keep_data_versions_monotonic
+
+Revision ID: 8d3b5f2e6a19
+Revises: 4e8a1d7c3b92
+Create Date: 2026-10-19 11:03:27.914862
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8d3b5f2e6a19'
+down_revision = '4e8a1d7c3b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('data_version.bumped_' || TG_ARGV[0], true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('data_version.bumped_' || TG_ARGV[0], 'on', true);
+
+            INSERT INTO data_version (name, version)
+            VALUES (TG_ARGV[0], nextval('data_version_seq'))
+            -- Commits may not come in the order of their versions, always move
+            -- past the current one, it may already be cached
+            ON CONFLICT (name) DO UPDATE
+            SET version = GREATEST(data_version.version + 1, EXCLUDED.version);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('data_version.bumped_' || TG_ARGV[0], true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('data_version.bumped_' || TG_ARGV[0], 'on', true);
+
+            INSERT INTO data_version (name, version)
+            VALUES (TG_ARGV[0], nextval('data_version_seq'))
+            ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
@@ -0,0 +1,53 @@
+"""create_data_version_table
+
+Revision ID: 8f2a6d41c7e5
+Revises: 4b1e7c2d9a30
+Create Date: 2026-10-18 16:02:47.118305
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '8f2a6d41c7e5'
+down_revision = '4b1e7c2d9a30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('data_version_seq')))
+    op.create_table(
+        'data_version',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO data_version (name, version)
+            VALUES (TG_ARGV[0], nextval('data_version_seq'))
+            ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_tree_version
+        AFTER INSERT OR DELETE OR UPDATE OF parent_team_id ON team
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version('team_tree');
+        """
+    )
+
+    op.execute(
+        "INSERT INTO data_version (name, version) VALUES ('team_tree', nextval('data_version_seq'))"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS team_tree_version ON team")
+    op.execute("DROP FUNCTION IF EXISTS bump_data_version()")
+    op.drop_table('data_version')
+    op.execute(sa.schema.DropSequence(sa.Sequence('data_version_seq')))
@@ -0,0 +1,69 @@
+"""add_team_and_experiments_teams_indexes
+
+Revision ID: 9a4f1c6e2b57
+Revises: 5e0c8b27f913
+Create Date: 2026-10-18 18:05:12.402117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '9a4f1c6e2b57'
+down_revision = '5e0c8b27f913'
+branch_labels = None
+depends_on = None
+
+
+def _drop_invalid_index(name: str):
+    """Drop what an interrupted concurrent build of the index left behind, if anything."""
+
+    invalid = op.get_bind().scalar(
+        sa.text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+        {'name': name},
+    )
+    if invalid:
+        op.execute(f'DROP INDEX CONCURRENTLY {name}')
+
+
+def upgrade() -> None:
+    # Names were not unique before, duplicates must be renamed by hand
+    query = "SELECT name FROM team GROUP BY name HAVING count(*) > 1 ORDER BY name LIMIT 10"
+    duplicates = op.get_bind().scalars(sa.text(query)).all()
+    if duplicates:
+        raise RuntimeError(
+            f'Team names must be unique, rename the duplicated ones first: {duplicates}'
+        )
+
+    # Built concurrently, outside of the migration transaction, so that
+    # writes go on while they build. Concurrent migrators are still kept
+    # out by the session level advisory lock of `env.py`.
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in (
+            ('ix_experiments_teams_team_id', 'experiments_teams', ['team_id'], False),
+            ('ix_team_parent_team_id', 'team', ['parent_team_id'], False),
+            ('uq_team_name', 'team', ['name'], True),
+        ):
+            _drop_invalid_index(name)
+            op.create_index(
+                name,
+                table,
+                columns,
+                unique=unique,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+    # Promoting the index to a constraint only takes a short lock
+    op.execute("ALTER TABLE team ADD CONSTRAINT uq_team_name UNIQUE USING INDEX uq_team_name")
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_team_name', 'team', type_='unique')
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_team_parent_team_id', table_name='team', postgresql_concurrently=True)
+        op.drop_index(
+            'ix_experiments_teams_team_id',
+            table_name='experiments_teams',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,84 @@
+"""add_experiment_team_ids_column
+
+Revision ID: c39d0e5b71a8
+Revises: 8f2a6d41c7e5
+Create Date: 2026-10-18 16:41:05.583920
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c39d0e5b71a8'
+down_revision = '8f2a6d41c7e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'experiment',
+        sa.Column(
+            'team_ids',
+            postgresql.ARRAY(sa.Integer()),
+            server_default=sa.text("'{}'"),
+            nullable=False,
+        ),
+    )
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION experiment_team_ids_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            UPDATE experiment e
+            SET team_ids = ARRAY(
+                SELECT team_id FROM experiments_teams et
+                WHERE et.experiment_id = e.id
+                ORDER BY team_id
+            )
+            WHERE e.id IN (SELECT experiment_id FROM changed_rows);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER experiment_team_ids_insert
+        AFTER INSERT ON experiments_teams REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION experiment_team_ids_sync();
+
+        CREATE TRIGGER experiment_team_ids_update
+        AFTER UPDATE ON experiments_teams REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION experiment_team_ids_sync();
+
+        CREATE TRIGGER experiment_team_ids_delete
+        AFTER DELETE ON experiments_teams REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION experiment_team_ids_sync();
+        """
+    )
+
+    # Backfill the team ids of existing experiments
+    op.execute(
+        """
+        UPDATE experiment e
+        SET team_ids = agg.team_ids
+        FROM (
+            SELECT experiment_id, ARRAY_AGG(team_id ORDER BY team_id) AS team_ids
+            FROM experiments_teams
+            GROUP BY experiment_id
+        ) agg
+        WHERE agg.experiment_id = e.id
+        """
+    )
+
+    op.create_index(
+        'ix_experiment_team_ids', 'experiment', ['team_ids'], postgresql_using='gin'
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_experiment_team_ids', table_name='experiment', postgresql_using='gin')
+    op.execute("DROP TRIGGER IF EXISTS experiment_team_ids_insert ON experiments_teams")
+    op.execute("DROP TRIGGER IF EXISTS experiment_team_ids_update ON experiments_teams")
+    op.execute("DROP TRIGGER IF EXISTS experiment_team_ids_delete ON experiments_teams")
+    op.execute("DROP FUNCTION IF EXISTS experiment_team_ids_sync()")
+    op.drop_column('experiment', 'team_ids')
@@ -0,0 +1,132 @@
+"""create_team_stats_table
+
+Revision ID: d2b7e5a41c08
+Revises: 9a4f1c6e2b57
+Create Date: 2026-10-18 19:02:47.118305
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd2b7e5a41c08'
+down_revision = '9a4f1c6e2b57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'team_stats',
+        sa.Column('team_id', sa.Integer(), nullable=False),
+        sa.Column('experiments', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column(
+            'subtree_experiments', sa.Integer(), server_default=sa.text('0'), nullable=False
+        ),
+        sa.ForeignKeyConstraint(['team_id'], ['team.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('team_id'),
+    )
+
+    # Links must not change between the backfill and the triggers
+    op.execute("LOCK TABLE experiments_teams IN SHARE MODE")
+
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION team_stats_sync() RETURNS TRIGGER AS $$
+        DECLARE
+            old_experiment_ids INT[] := '{}';
+            old_team_ids INT[] := '{}';
+            new_experiment_ids INT[] := '{}';
+            new_team_ids INT[] := '{}';
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT coalesce(array_agg(experiment_id), '{}'), coalesce(array_agg(team_id), '{}')
+                INTO old_experiment_ids, old_team_ids
+                FROM old_rows;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                SELECT coalesce(array_agg(experiment_id), '{}'), coalesce(array_agg(team_id), '{}')
+                INTO new_experiment_ids, new_team_ids
+                FROM new_rows;
+            END IF;
+
+            WITH changed_links AS (
+                SELECT experiment_id, team_id, -1 AS delta
+                FROM unnest(old_experiment_ids, old_team_ids) AS l (experiment_id, team_id)
+                UNION ALL
+                SELECT experiment_id, team_id, 1
+                FROM unnest(new_experiment_ids, new_team_ids) AS l (experiment_id, team_id)
+            ), changed_pairs AS (
+                -- links added minus links removed, of experiments below their ancestors
+                SELECT l.experiment_id, c.ancestor_id, sum(l.delta) AS delta
+                FROM changed_links l
+                JOIN team_closure c ON c.descendant_id = l.team_id
+                GROUP BY l.experiment_id, c.ancestor_id
+            ), current_pairs AS (
+                SELECT et.experiment_id, c.ancestor_id, count(*) AS links
+                FROM experiments_teams et
+                JOIN team_closure c ON c.descendant_id = et.team_id
+                WHERE et.experiment_id IN (SELECT experiment_id FROM changed_links)
+                GROUP BY et.experiment_id, c.ancestor_id
+            ), deltas AS (
+                SELECT team_id, sum(delta) AS experiments, 0 AS subtree_experiments
+                FROM changed_links
+                GROUP BY team_id
+                UNION ALL
+                -- an experiment counts in a subtree while it has any link in it
+                SELECT
+                    p.ancestor_id,
+                    0,
+                    sum(
+                        (coalesce(cp.links, 0) > 0)::int
+                        - (coalesce(cp.links, 0) - p.delta > 0)::int
+                    )
+                FROM changed_pairs p
+                LEFT JOIN current_pairs cp USING (experiment_id, ancestor_id)
+                GROUP BY p.ancestor_id
+            )
+            INSERT INTO team_stats AS s (team_id, experiments, subtree_experiments)
+            SELECT team_id, sum(experiments), sum(subtree_experiments)
+            FROM deltas
+            GROUP BY team_id
+            ON CONFLICT (team_id) DO UPDATE
+            SET experiments = s.experiments + EXCLUDED.experiments,
+                subtree_experiments = s.subtree_experiments + EXCLUDED.subtree_experiments;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_stats_insert
+        AFTER INSERT ON experiments_teams REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_stats_sync();
+
+        CREATE TRIGGER team_stats_update
+        AFTER UPDATE ON experiments_teams REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_stats_sync();
+
+        CREATE TRIGGER team_stats_delete
+        AFTER DELETE ON experiments_teams REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_stats_sync();
+        """
+    )
+
+    # Backfill the counts of the existing experiments
+    op.execute(
+        """
+        INSERT INTO team_stats (team_id, experiments, subtree_experiments)
+        SELECT c.ancestor_id,
+            count(*) FILTER (WHERE c.depth = 0),
+            count(DISTINCT et.experiment_id)
+        FROM experiments_teams et
+        JOIN team_closure c ON c.descendant_id = et.team_id
+        GROUP BY c.ancestor_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS team_stats_delete ON experiments_teams")
+    op.execute("DROP TRIGGER IF EXISTS team_stats_update ON experiments_teams")
+    op.execute("DROP TRIGGER IF EXISTS team_stats_insert ON experiments_teams")
+    op.execute("DROP FUNCTION IF EXISTS team_stats_sync()")
+    op.drop_table('team_stats')
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from collections.abc import Awaitable
+from collections.abc import Callable
+from threading import Lock
+from typing import Generic
+from typing import TypeVar
+
+T = TypeVar('T')
+
+
+class VersionedCache(Generic[T]):
+    """Process wide value, reloaded whenever the version of its source data changes."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._cached: tuple[int, T] | None = None
+
+    def get(self, version: int, load: Callable[[], T]) -> T:
+        cached = self._cached
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._cached
+            if cached is None or cached[0] != version:
+                cached = self._cached = (version, load())
+
+        return cached[1]
+
+    async def get_async(self, version: int, load: Callable[[], Awaitable[T]]) -> T:
+        """
+        `get` for event loops, with an async `load`.
+
+        No lock is held while loading: blocking the loop thread on it could
+        deadlock, instead concurrent tasks may both load the same version.
+        """
+
+        cached = self._cached
+        if cached is None or cached[0] != version:
+            cached = self._cached = (version, await load())
+
+        return cached[1]
+
+    def invalidate(self):
+        self._cached = None
+
+
+class LRUCache(Generic[T]):
+    """Thread safe, bounded least recently used cache. Disabled when `size` is 0."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = Lock()
+        self._items: OrderedDict[str, T] = OrderedDict()
+
+    def get(self, key: str) -> T | None:
+        with self._lock:
+            if (value := self._items.get(key)) is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: T):
+        if not self.size:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
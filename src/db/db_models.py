@@ -1,14 +1,31 @@
 import datetime
+from collections.abc import Callable
+from collections.abc import Iterable
+from time import perf_counter
 
+from sqlalchemy import DDL
 from sqlalchemy import TIMESTAMP
+from sqlalchemy import BigInteger
 from sqlalchemy import Column
+from sqlalchemy import FetchedValue
 from sqlalchemy import ForeignKey
+from sqlalchemy import Index
 from sqlalchemy import Integer
+from sqlalchemy import Select
+from sqlalchemy import Sequence
+from sqlalchemy import String
 from sqlalchemy import Table
+from sqlalchemy import UniqueConstraint
 from sqlalchemy import create_engine
+from sqlalchemy import event
 from sqlalchemy import func
 from sqlalchemy import select
 from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import Session
@@ -16,8 +33,18 @@ from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
-
+from sqlalchemy.pool import QueuePool
+
+from config import DATABASE_ASYNC_URL
+from config import DATABASE_MAX_OVERFLOW
+from config import DATABASE_POOL_PRE_PING
+from config import DATABASE_POOL_RECYCLE
+from config import DATABASE_POOL_SIZE
+from config import DATABASE_REPLICA_URL
+from config import DATABASE_STATEMENT_TIMEOUT
 from config import DATABASE_URL
+from db.cache import VersionedCache
+from db.team_tree import TeamTree
 
 
 class Base(DeclarativeBase):
@@ -28,27 +55,126 @@ class Base(DeclarativeBase):
 
 metadata = Base.metadata
 engine = None
+# Engine of the read replica, the primary `engine` when there is none
+replica_engine = None
 session: Session = None
+async_engine: AsyncEngine = None
+async_session_factory: async_sessionmaker = None
+
+
+team_tree_cache: VersionedCache[TeamTree] = VersionedCache()
+
+
+class RoutingSession(Session):
+    """
+    Session sending its SELECTs to the replica while `info['read_only']` is set.
+
+    Anything else, flushes included, goes to the primary it is bound to.
+    """
+
+    def __init__(self, *args, replica=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if (
+            self.replica is not None
+            and self.info.get('read_only')
+            and not self._flushing
+            and isinstance(clause, Select)
+        ):
+            return self.replica
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+class TimedQueuePool(QueuePool):
+    """`QueuePool` reporting how long every checkout waited to `wait_listeners`."""
+
+    wait_listeners: list[Callable[[float], None]] = []
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            for listener in self.wait_listeners:
+                listener(perf_counter() - start)
 
 
 def get_session() -> Session:
     return session
 
 
+def set_read_only(read_only: bool):
+    """Route the reads of the current session to the replica, or back to the primary."""
+
+    session.info['read_only'] = read_only
+
+
+def _pool_options() -> dict:
+    return dict(
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_pre_ping=DATABASE_POOL_PRE_PING,
+        pool_recycle=DATABASE_POOL_RECYCLE,
+    )
+
+
+def _build_engine(url: str):
+    connect_args = {}
+    if DATABASE_STATEMENT_TIMEOUT:
+        connect_args['options'] = f'-c statement_timeout={DATABASE_STATEMENT_TIMEOUT}'
+    return create_engine(
+        url, poolclass=TimedQueuePool, connect_args=connect_args, **_pool_options()
+    )
+
+
 def _create_engine():
-    global engine
-    engine = create_engine(DATABASE_URL)
+    global engine, replica_engine
+    engine = _build_engine(DATABASE_URL)
+    replica_engine = _build_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
     return engine
 
 
-def setup_db(engine=None):
+def setup_db(engine=None, replica=None):
     global session
     if not engine:
         engine = _create_engine()
-    session_factory = sessionmaker(engine, autocommit=False)
+    session_factory = sessionmaker(
+        engine, class_=RoutingSession, autocommit=False, replica=replica or replica_engine
+    )
     session = scoped_session(session_factory)
 
 
+def remove_session(exception=None):
+    """Close the session of the current thread, its objects and connections with it."""
+
+    session.remove()
+
+
+def setup_async_db(engine=None):
+    """Set up the asyncio engine and session factory, see `get_async_session`."""
+
+    global async_engine, async_session_factory
+    if not engine:
+        server_settings = {}
+        if DATABASE_STATEMENT_TIMEOUT:
+            server_settings['statement_timeout'] = str(DATABASE_STATEMENT_TIMEOUT)
+        engine = create_async_engine(
+            DATABASE_ASYNC_URL,
+            connect_args={'server_settings': server_settings},
+            **_pool_options(),
+        )
+    async_engine = engine
+    async_session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+
+def get_async_session() -> AsyncSession:
+    """Return a new asyncio session, to be used as an async context manager."""
+
+    return async_session_factory()
+
+
 experiments_teams = Table(
     'experiments_teams',
     Base.metadata,
@@ -64,6 +190,8 @@ experiments_teams = Table(
         ForeignKey('team.id'),
         primary_key=True,
     ),
+    # The primary key only serves lookups by experiment
+    Index('ix_experiments_teams_team_id', 'team_id'),
 )
 
 
@@ -78,8 +206,20 @@ class Experiment(Base):
 
     sample_ratio: Mapped[int]
 
+    # Denormalized copy of the experiment's team ids, maintained by the
+    # `experiment_team_ids_sync` trigger for GIN-indexed team filtering.
+    team_ids: Mapped[list[int]] = mapped_column(
+        ARRAY(Integer), server_default=text("'{}'"), deferred=True
+    )
+
     teams: Mapped[list["Team"]] = relationship(
-        secondary=experiments_teams, uselist=True, lazy='selectin', back_populates="experiments"
+        secondary=experiments_teams, uselist=True, lazy='select', back_populates="experiments"
+    )
+
+    __table_args__ = (
+        Index('ix_experiment_team_ids', 'team_ids', postgresql_using='gin'),
+        # Keyset pagination on `sort_by=sample_ratio`
+        Index('ix_experiment_sample_ratio_id', 'sample_ratio', 'id'),
     )
 
 
@@ -87,14 +227,22 @@ class Team(Base):
     """Database model for team model."""
 
     __tablename__ = 'team'
+    __table_args__ = (UniqueConstraint('name', name='uq_team_name'),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    parent_team_id: Mapped[int] = mapped_column(ForeignKey("team.id"), nullable=True)
+    parent_team_id: Mapped[int] = mapped_column(ForeignKey("team.id"), nullable=True, index=True)
 
     name: Mapped[str]
 
+    # Ids of the teams from the top-level one down to the team itself,
+    # maintained by the `team_path_sync` and `team_path_move` triggers, see
+    # `is_ancestor_path`.
+    path: Mapped[list[int]] = mapped_column(
+        ARRAY(Integer), server_default=text("'{}'"), server_onupdate=FetchedValue()
+    )
+
     experiments: Mapped[list["Experiment"]] = relationship(
-        secondary=experiments_teams, uselist=True, lazy='selectin', back_populates="teams"
+        secondary=experiments_teams, uselist=True, lazy='select', back_populates="teams"
     )
 
     @staticmethod
@@ -102,47 +250,505 @@ class Team(Base):
         """
         Return all teams down the hierarchy of teams.
         """
-        session = get_session()
-
-        query = text(
-            """
-        WITH RECURSIVE levels AS (
-            SELECT parent_team_id, '{}'::INT[] || id AS children
-            FROM team
-            UNION ALL
-            SELECT t.parent_team_id, l.children || t.id
-            FROM team t
-            JOIN levels l ON t.id = l.parent_team_id
-        ),
-        parent_subteams AS (
-            SELECT
-                parent_team_id AS team_id, ARRAY_AGG(DISTINCT child) AS children
-            FROM
-                levels,
-                LATERAL UNNEST(children) AS child
-            WHERE
-                parent_team_id IN :team_ids
-            GROUP BY
-            parent_team_id
-        )
-        -- TODO: So we use this for queries - Ideally this is a Mat view 
-        SELECT ARRAY_AGG(DISTINCT child) FROM parent_subteams, UNNEST(children) child
-            
-        """
-        )
-        params = {
-            'team_ids': team_ids,
-        }
+        return get_team_tree().sub_teams(team_ids)
+
+
+def is_ancestor_path(ancestor_path: list[int], descendant_path: list[int]) -> bool:
+    """
+    Return whether a team is a strict ancestor of another, given their `Team.path`.
+
+    A team is an ancestor when its id sits at its own depth in the other's
+    path, a single lookup whatever the size of the hierarchy.
+    """
+    depth = len(ancestor_path)
+    return 0 < depth < len(descendant_path) and descendant_path[depth - 1] == ancestor_path[-1]
+
+
+def paths_related(paths: Iterable[list[int]]) -> bool:
+    """Return whether any of the teams, given by their `Team.path`, descends from another one."""
+
+    paths = list(paths)
+    return any(is_ancestor_path(a, b) for a in paths for b in paths if a is not b)
+
+
+def lock_team_moves(shared: bool = False):
+    """
+    Take the lock of team moves until the end of the transaction.
+
+    Moves take it exclusively, as the `team_closure_sync` trigger does, so
+    that their checks see the hierarchy left by the previous move. Writes
+    checking the ancestry of teams take it shared: no team moves between
+    their check and their commit.
+    """
+    lock = func.pg_advisory_xact_lock_shared if shared else func.pg_advisory_xact_lock
+
+    get_session().execute(select(lock(func.hashtext('team_closure'))))
 
-        return session.scalar(query, params=params) or []
 
+def get_team_tree() -> TeamTree:
+    """
+    Return the in-process team hierarchy index.
 
-# TODO: extract to a MAT VIEW
-experiment_teams_cte = (
-    select(
-        experiments_teams.c.experiment_id,
-        func.array_agg(experiments_teams.c.team_id).label("team_ids"),
+    Only the `team_tree` data version is read on every call, the tree itself
+    is reloaded once per hierarchy change.
+    """
+    session = get_session()
+
+    return team_tree_cache.get(
+        get_data_version('team_tree'),
+        lambda: TeamTree(session.execute(select(Team.id, Team.parent_team_id))),
     )
-    .group_by(experiments_teams.c.experiment_id)
-    .cte()
+
+
+async def get_team_tree_async(session: AsyncSession) -> TeamTree:
+    """`get_team_tree` through an asyncio session."""
+
+    async def load():
+        return TeamTree(await session.execute(select(Team.id, Team.parent_team_id)))
+
+    (version,) = await get_data_versions_async(session, 'team_tree')
+    return await team_tree_cache.get_async(version, load)
+
+
+def get_data_version(name: str) -> int:
+    """Return the current version of some derived data, 0 if never bumped."""
+
+    return get_data_versions(name)[0]
+
+
+def _data_versions_query(names: tuple[str, ...]):
+    return select(data_version.c.name, data_version.c.version).where(
+        data_version.c.name.in_(names)
+    )
+
+
+def get_data_versions(*names: str) -> tuple[int, ...]:
+    """Return the current versions of many derived data at once."""
+
+    session = get_session()
+
+    versions = dict(session.execute(_data_versions_query(names)).all())
+
+    return tuple(versions.get(name, 0) for name in names)
+
+
+async def get_data_versions_async(session: AsyncSession, *names: str) -> tuple[int, ...]:
+    """`get_data_versions` through an asyncio session."""
+
+    versions = dict((await session.execute(_data_versions_query(names))).all())
+
+    return tuple(versions.get(name, 0) for name in names)
+
+
+# Monotonic versions of derived data, bumped through the `bump_data_version`
+# trigger function so that in-process caches know when to reload. Its triggers
+# are deferred to the commit and bump once per transaction, the row of a
+# version is only locked while committing, writers do not queue behind it.
+# Until then a transaction reads the versions prior to its own changes, it
+# must commit them before reading cached data derived from them.
+data_version_seq = Sequence('data_version_seq', metadata=Base.metadata)
+
+data_version = Table(
+    'data_version',
+    Base.metadata,
+    Column('name', String, primary_key=True),
+    Column('version', BigInteger, nullable=False),
+)
+
+event.listen(
+    Base.metadata,
+    'before_create',
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('data_version.bumped_' || TG_ARGV[0], true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('data_version.bumped_' || TG_ARGV[0], 'on', true);
+
+            INSERT INTO data_version (name, version)
+            VALUES (TG_ARGV[0], nextval('data_version_seq'))
+            -- Commits may not come in the order of their versions, always move
+            -- past the current one, it may already be cached
+            ON CONFLICT (name) DO UPDATE
+            SET version = GREATEST(data_version.version + 1, EXCLUDED.version);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    ),
+)
+event.listen(
+    Base.metadata,
+    'after_drop',
+    DDL("DROP FUNCTION IF EXISTS bump_data_version() CASCADE"),
+)
+event.listen(
+    Experiment.__table__,
+    'after_create',
+    DDL(
+        """
+        CREATE CONSTRAINT TRIGGER experiment_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiment
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION bump_data_version('experiments');
+        """
+    ),
+)
+event.listen(
+    experiments_teams,
+    'after_create',
+    DDL(
+        """
+        CREATE CONSTRAINT TRIGGER experiments_teams_data_version
+        AFTER INSERT OR UPDATE OR DELETE ON experiments_teams
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION bump_data_version('experiments');
+        """
+    ),
+)
+event.listen(
+    Team.__table__,
+    'after_create',
+    DDL(
+        """
+        CREATE CONSTRAINT TRIGGER team_tree_version
+        AFTER INSERT OR DELETE OR UPDATE OF parent_team_id ON team
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION bump_data_version('team_tree');
+        """
+    ),
+)
+event.listen(
+    Team.__table__,
+    'after_create',
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION team_path_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            -- Serialized with the moves, the parent path read is not about to change
+            PERFORM pg_advisory_xact_lock(hashtext('team_closure'));
+            NEW.path := coalesce(
+                (SELECT path FROM team WHERE id = NEW.parent_team_id), '{}'
+            ) || NEW.id;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_path_sync
+        BEFORE INSERT ON team
+        FOR EACH ROW EXECUTE FUNCTION team_path_sync();
+
+        -- Paths of the moved subtrees are rebuilt from the closure once the
+        -- whole statement is done, it may move many teams at once
+        CREATE OR REPLACE FUNCTION team_path_move() RETURNS TRIGGER AS $$
+        BEGIN
+            -- Also stops the recursion of its own update
+            IF NOT EXISTS (
+                SELECT FROM new_rows n JOIN old_rows o USING (id)
+                WHERE n.parent_team_id IS DISTINCT FROM o.parent_team_id
+            ) THEN
+                RETURN NULL;
+            END IF;
+
+            UPDATE team t
+            SET path = p.path
+            FROM (
+                SELECT c.descendant_id, array_agg(c.ancestor_id ORDER BY c.depth DESC) AS path
+                FROM team_closure c
+                WHERE c.descendant_id IN (
+                    SELECT sub.descendant_id
+                    FROM new_rows n
+                    JOIN old_rows o USING (id)
+                    JOIN team_closure sub ON sub.ancestor_id = n.id
+                    WHERE n.parent_team_id IS DISTINCT FROM o.parent_team_id
+                )
+                GROUP BY c.descendant_id
+            ) p
+            WHERE t.id = p.descendant_id AND t.path IS DISTINCT FROM p.path;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_path_move
+        AFTER UPDATE ON team REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_path_move();
+        """
+    ),
+)
+event.listen(
+    Team.__table__,
+    'before_drop',
+    DDL("DROP FUNCTION IF EXISTS team_path_sync() CASCADE"),
+)
+event.listen(
+    Team.__table__,
+    'before_drop',
+    DDL("DROP FUNCTION IF EXISTS team_path_move() CASCADE"),
+)
+
+
+# Every (ancestor, descendant) pair of the team hierarchy, including the
+# (team, team) pair at depth 0. Maintained by the `team_closure_sync` trigger
+# whenever a team is created or re-parented, which also refuses moves creating
+# cycles.
+team_closure = Table(
+    'team_closure',
+    Base.metadata,
+    Column(
+        'ancestor_id',
+        Integer,
+        ForeignKey('team.id', ondelete='CASCADE'),
+        primary_key=True,
+    ),
+    Column(
+        'descendant_id',
+        Integer,
+        ForeignKey('team.id', ondelete='CASCADE'),
+        primary_key=True,
+    ),
+    Column('depth', Integer, nullable=False),
+    Index('ix_team_closure_descendant_id', 'descendant_id'),
+)
+
+event.listen(
+    team_closure,
+    'after_create',
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION team_closure_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT NEW.id, NEW.id, 0
+                UNION ALL
+                SELECT ancestor_id, NEW.id, depth + 1
+                FROM team_closure
+                WHERE descendant_id = NEW.parent_team_id;
+            ELSIF NEW.parent_team_id IS DISTINCT FROM OLD.parent_team_id THEN
+                -- Moves are serialized, each one sees the hierarchy left by the previous
+                PERFORM pg_advisory_xact_lock(hashtext('team_closure'));
+                IF EXISTS (
+                    SELECT FROM team_closure
+                    WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_team_id
+                ) THEN
+                    RAISE EXCEPTION 'team %% cannot be moved below team %%',
+                        NEW.id, NEW.parent_team_id
+                    USING ERRCODE = 'check_violation', CONSTRAINT = 'team_hierarchy_cycle';
+                END IF;
+
+                PERFORM team_stats_move(NEW.id, -1);
+                -- Detach the subtree from its former ancestors
+                DELETE FROM team_closure
+                WHERE descendant_id IN (
+                    SELECT descendant_id FROM team_closure WHERE ancestor_id = NEW.id
+                )
+                AND ancestor_id IN (
+                    SELECT ancestor_id FROM team_closure
+                    WHERE descendant_id = NEW.id AND ancestor_id != NEW.id
+                );
+                -- and attach it below the ancestors of the new parent
+                INSERT INTO team_closure (ancestor_id, descendant_id, depth)
+                SELECT super.ancestor_id, sub.descendant_id, super.depth + sub.depth + 1
+                FROM team_closure super
+                CROSS JOIN team_closure sub
+                WHERE super.descendant_id = NEW.parent_team_id AND sub.ancestor_id = NEW.id;
+                PERFORM team_stats_move(NEW.id, 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_closure_sync
+        AFTER INSERT OR UPDATE OF parent_team_id ON team
+        FOR EACH ROW EXECUTE FUNCTION team_closure_sync();
+        """
+    ),
+)
+event.listen(
+    team_closure,
+    'before_drop',
+    DDL("DROP FUNCTION IF EXISTS team_closure_sync() CASCADE"),
+)
+
+
+event.listen(
+    experiments_teams,
+    'after_create',
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION experiment_team_ids_sync() RETURNS TRIGGER AS $$
+        BEGIN
+            UPDATE experiment e
+            SET team_ids = ARRAY(
+                SELECT team_id FROM experiments_teams et
+                WHERE et.experiment_id = e.id
+                ORDER BY team_id
+            )
+            WHERE e.id IN (SELECT experiment_id FROM changed_rows);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER experiment_team_ids_insert
+        AFTER INSERT ON experiments_teams REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION experiment_team_ids_sync();
+
+        CREATE TRIGGER experiment_team_ids_update
+        AFTER UPDATE ON experiments_teams REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION experiment_team_ids_sync();
+
+        CREATE TRIGGER experiment_team_ids_delete
+        AFTER DELETE ON experiments_teams REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION experiment_team_ids_sync();
+        """
+    ),
+)
+event.listen(
+    experiments_teams,
+    'before_drop',
+    DDL("DROP FUNCTION IF EXISTS experiment_team_ids_sync() CASCADE"),
+)
+
+
+# Experiment counts of every team, maintained by the `team_stats_sync` trigger
+# whenever experiments are linked to or unlinked from teams. `experiments`
+# counts the experiments of the team itself, `subtree_experiments` the distinct
+# experiments of the team and all its descendants. Teams without experiments
+# may have no row.
+team_stats = Table(
+    'team_stats',
+    Base.metadata,
+    Column('team_id', Integer, ForeignKey('team.id', ondelete='CASCADE'), primary_key=True),
+    Column('experiments', Integer, nullable=False, server_default=text('0')),
+    Column('subtree_experiments', Integer, nullable=False, server_default=text('0')),
+)
+
+event.listen(
+    experiments_teams,
+    'after_create',
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION team_stats_sync() RETURNS TRIGGER AS $$
+        DECLARE
+            old_experiment_ids INT[] := '{}';
+            old_team_ids INT[] := '{}';
+            new_experiment_ids INT[] := '{}';
+            new_team_ids INT[] := '{}';
+        BEGIN
+            -- Moves are waited for, the ancestors read are not about to change
+            PERFORM pg_advisory_xact_lock_shared(hashtext('team_closure'));
+
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                SELECT coalesce(array_agg(experiment_id), '{}'), coalesce(array_agg(team_id), '{}')
+                INTO old_experiment_ids, old_team_ids
+                FROM old_rows;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                SELECT coalesce(array_agg(experiment_id), '{}'), coalesce(array_agg(team_id), '{}')
+                INTO new_experiment_ids, new_team_ids
+                FROM new_rows;
+            END IF;
+
+            WITH changed_links AS (
+                SELECT experiment_id, team_id, -1 AS delta
+                FROM unnest(old_experiment_ids, old_team_ids) AS l (experiment_id, team_id)
+                UNION ALL
+                SELECT experiment_id, team_id, 1
+                FROM unnest(new_experiment_ids, new_team_ids) AS l (experiment_id, team_id)
+            ), changed_pairs AS (
+                -- links added minus links removed, of experiments below their ancestors
+                SELECT l.experiment_id, c.ancestor_id, sum(l.delta) AS delta
+                FROM changed_links l
+                JOIN team_closure c ON c.descendant_id = l.team_id
+                GROUP BY l.experiment_id, c.ancestor_id
+            ), current_pairs AS (
+                SELECT et.experiment_id, c.ancestor_id, count(*) AS links
+                FROM experiments_teams et
+                JOIN team_closure c ON c.descendant_id = et.team_id
+                WHERE et.experiment_id IN (SELECT experiment_id FROM changed_links)
+                GROUP BY et.experiment_id, c.ancestor_id
+            ), deltas AS (
+                SELECT team_id, sum(delta) AS experiments, 0 AS subtree_experiments
+                FROM changed_links
+                GROUP BY team_id
+                UNION ALL
+                -- an experiment counts in a subtree while it has any link in it
+                SELECT
+                    p.ancestor_id,
+                    0,
+                    sum(
+                        (coalesce(cp.links, 0) > 0)::int
+                        - (coalesce(cp.links, 0) - p.delta > 0)::int
+                    )
+                FROM changed_pairs p
+                LEFT JOIN current_pairs cp USING (experiment_id, ancestor_id)
+                GROUP BY p.ancestor_id
+            )
+            INSERT INTO team_stats AS s (team_id, experiments, subtree_experiments)
+            SELECT team_id, sum(experiments), sum(subtree_experiments)
+            FROM deltas
+            GROUP BY team_id
+            ON CONFLICT (team_id) DO UPDATE
+            SET experiments = s.experiments + EXCLUDED.experiments,
+                subtree_experiments = s.subtree_experiments + EXCLUDED.subtree_experiments;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        -- Moves a subtree out of its ancestors (-1) or into them (1), called
+        -- by `team_closure_sync`. Experiments of the subtree only count for an
+        -- ancestor through the subtree when all their links below it are there.
+        CREATE OR REPLACE FUNCTION team_stats_move(moved_team_id INT, direction INT)
+        RETURNS VOID AS $$
+        BEGIN
+            WITH moved_links AS (
+                SELECT et.experiment_id, count(*) AS links
+                FROM team_closure sub
+                JOIN experiments_teams et ON et.team_id = sub.descendant_id
+                WHERE sub.ancestor_id = moved_team_id
+                GROUP BY et.experiment_id
+            ), ancestor_links AS (
+                SELECT c.ancestor_id, m.links, count(*) AS ancestor_links
+                FROM moved_links m
+                JOIN experiments_teams et ON et.experiment_id = m.experiment_id
+                JOIN team_closure c ON c.descendant_id = et.team_id
+                JOIN team_closure a ON a.ancestor_id = c.ancestor_id
+                WHERE a.descendant_id = moved_team_id AND a.depth > 0
+                GROUP BY c.ancestor_id, m.experiment_id, m.links
+            )
+            INSERT INTO team_stats AS s (team_id, subtree_experiments)
+            SELECT ancestor_id, direction * count(*)
+            FROM ancestor_links
+            WHERE ancestor_links = links
+            GROUP BY ancestor_id
+            ON CONFLICT (team_id) DO UPDATE
+            SET subtree_experiments = s.subtree_experiments + EXCLUDED.subtree_experiments;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER team_stats_insert
+        AFTER INSERT ON experiments_teams REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_stats_sync();
+
+        CREATE TRIGGER team_stats_update
+        AFTER UPDATE ON experiments_teams REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_stats_sync();
+
+        CREATE TRIGGER team_stats_delete
+        AFTER DELETE ON experiments_teams REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION team_stats_sync();
+        """
+    ),
+)
+event.listen(
+    experiments_teams,
+    'before_drop',
+    DDL("DROP FUNCTION IF EXISTS team_stats_sync() CASCADE"),
+)
+event.listen(
+    experiments_teams,
+    'before_drop',
+    DDL("DROP FUNCTION IF EXISTS team_stats_move(INT, INT)"),
 )
@@ -0,0 +1,76 @@
+from array import array
+from collections.abc import Iterable
+
+
+class TeamTree:
+    """
+    In-memory index of the team hierarchy.
+
+    Teams are addressed by their position in `ids`. Each position carries the
+    interval [pre, end) of a pre-order walk of the forest: the descendants of a
+    team are exactly the teams whose `pre` falls inside it, so a subtree is one
+    contiguous slice of `order`.
+    """
+
+    def __init__(self, rows: Iterable[tuple[int, int | None]]):
+        rows = list(rows)
+
+        self.ids = array('l', (team_id for team_id, _ in rows))
+        self.positions = {team_id: pos for pos, team_id in enumerate(self.ids)}
+
+        size = len(self.ids)
+        self.parents = array('l', [-1]) * size
+        for pos, (_, parent_id) in enumerate(rows):
+            if parent_id is not None:
+                self.parents[pos] = self.positions.get(parent_id, -1)
+
+        # children of every team stored contiguously, CSR style
+        self.child_offsets = array('l', [0]) * (size + 1)
+        for parent in self.parents:
+            if parent >= 0:
+                self.child_offsets[parent + 1] += 1
+        for pos in range(size):
+            self.child_offsets[pos + 1] += self.child_offsets[pos]
+        self.children = array('l', [0]) * self.child_offsets[size]
+        fill = self.child_offsets[:-1]
+        for pos, parent in enumerate(self.parents):
+            if parent >= 0:
+                self.children[fill[parent]] = pos
+                fill[parent] += 1
+
+        # pre-order intervals, unreachable teams (cycles) keep (-1, -1)
+        self.pre = array('l', [-1]) * size
+        self.end = array('l', [-1]) * size
+        self.order = array('l')
+        for root in range(size):
+            if self.parents[root] >= 0:
+                continue
+            stack = [root]
+            while stack:
+                pos = stack.pop()
+                if pos < 0:
+                    self.end[~pos] = len(self.order)
+                    continue
+                self.pre[pos] = len(self.order)
+                self.order.append(pos)
+                stack.append(~pos)
+                stack.extend(self.children[self.child_offsets[pos] : self.child_offsets[pos + 1]])
+
+    def sub_teams(self, team_ids: Iterable[int]) -> list[int]:
+        """Return the ids of all teams below any of the given teams."""
+
+        intervals = sorted(
+            (self.pre[pos] + 1, self.end[pos])
+            for pos in (self.positions.get(team_id) for team_id in team_ids)
+            if pos is not None and self.pre[pos] >= 0
+        )
+
+        sub_teams = []
+        covered = 0
+        for start, end in intervals:
+            start = max(start, covered)
+            if start < end:
+                sub_teams.extend(self.ids[pos] for pos in self.order[start:end])
+                covered = end
+
+        return sub_teams
@@ -0,0 +1,193 @@
+"""
+Compact, versioned snapshot of the experiment configuration.
+
+Clients `mmap` a snapshot file and evaluate assignments locally, without
+copying nor parsing it. The layout is, all little-endian:
+
+- a 32 bytes header (`HEADER`)
+- one fixed-width record per experiment (`RECORD`), ordered by id
+- the team ids of all experiments as int32, referenced by the records
+- a UTF-8 string table holding the descriptions, referenced by the records
+"""
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections.abc import Iterable
+
+import numpy as np
+from sqlalchemy import select
+
+import assignment
+from db.cache import VersionedCache
+from db.db_models import Experiment
+from db.db_models import get_data_version
+from db.db_models import get_session
+from db.db_models import setup_db
+
+MAGIC = b'RTSN'
+FORMAT_VERSION = 1
+
+# magic, format version, reserved, data version, experiments, team ids, string table size
+HEADER = struct.Struct('<4sHHQIIII')
+RECORD = np.dtype(
+    [
+        ('id', '<i4'),
+        ('sample_ratio', '<i4'),
+        ('teams_offset', '<u4'),
+        ('teams_count', '<u4'),
+        ('description_offset', '<u4'),
+        ('description_length', '<u4'),
+    ]
+)
+
+snapshot_cache: VersionedCache[bytes] = VersionedCache()
+
+
+def compile_snapshot(
+    version: int, experiments: Iterable[tuple[int, int, list[int], str]]
+) -> bytes:
+    """Compile (id, sample_ratio, team_ids, description) rows, ordered by id, to a snapshot."""
+
+    records = []
+    team_ids = []
+    strings = bytearray()
+    for experiment_id, sample_ratio, experiment_team_ids, description in experiments:
+        description = description.encode()
+        records.append(
+            (
+                experiment_id,
+                sample_ratio,
+                len(team_ids),
+                len(experiment_team_ids),
+                len(strings),
+                len(description),
+            )
+        )
+        team_ids.extend(experiment_team_ids)
+        strings += description
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, 0, version, len(records), len(team_ids), len(strings), 0
+    )
+
+    return b''.join(
+        (
+            header,
+            np.array(records, dtype=RECORD).tobytes(),
+            np.array(team_ids, dtype='<i4').tobytes(),
+            bytes(strings),
+        )
+    )
+
+
+def build_snapshot(version: int) -> bytes:
+    """
+    Compile a snapshot of the experiments currently in the database.
+
+    `version` should be read before calling, the snapshot may then only be
+    newer than the version it is labeled with, never older.
+    """
+
+    session = get_session()
+
+    rows = session.execute(
+        select(
+            Experiment.id, Experiment.sample_ratio, Experiment.team_ids, Experiment.description
+        )
+        .order_by(Experiment.id)
+        .execution_options(yield_per=10000)
+    )
+
+    return compile_snapshot(version, rows)
+
+
+def latest_snapshot() -> tuple[int, bytes]:
+    """Return the current snapshot and its version, compiled once per version."""
+
+    version = get_data_version('experiments')
+    return version, snapshot_cache.get(version, lambda: build_snapshot(version))
+
+
+class Snapshot:
+    """Zero-copy reader over a compiled snapshot."""
+
+    def __init__(self, buffer):
+        magic, format_version, _, version, experiments, team_ids, strings, _ = (
+            HEADER.unpack_from(buffer)
+        )
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError('Not a snapshot of a supported format')
+
+        self.buffer = buffer
+        self.version = version
+
+        offset = HEADER.size
+        self.records = np.frombuffer(buffer, dtype=RECORD, count=experiments, offset=offset)
+        offset += self.records.nbytes
+        self.team_ids = np.frombuffer(buffer, dtype='<i4', count=team_ids, offset=offset)
+        offset += self.team_ids.nbytes
+        self.strings = memoryview(buffer)[offset : offset + strings]
+
+    @classmethod
+    def open(cls, path: str) -> 'Snapshot':
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self.records)
+
+    def _record(self, experiment_id: int):
+        pos = np.searchsorted(self.records['id'], experiment_id)
+        if pos == len(self.records) or self.records['id'][pos] != experiment_id:
+            raise KeyError(experiment_id)
+        return self.records[pos]
+
+    def sample_ratio(self, experiment_id: int) -> int:
+        return int(self._record(experiment_id)['sample_ratio'])
+
+    def experiment_team_ids(self, experiment_id: int) -> np.ndarray:
+        record = self._record(experiment_id)
+        start = record['teams_offset']
+        return self.team_ids[start : start + record['teams_count']]
+
+    def description(self, experiment_id: int) -> str:
+        record = self._record(experiment_id)
+        start = record['description_offset']
+        return str(self.strings[start : start + record['description_length']], 'utf-8')
+
+    def assign(self, experiment_id: int, unit_id: int | str) -> str | None:
+        """Local `assignment.assign` of a unit to an experiment of the snapshot."""
+
+        return assignment.assign(experiment_id, self.sample_ratio(experiment_id), unit_id)
+
+
+def write_snapshot(path: str) -> int:
+    """
+    Write a snapshot of the database to `path`, return its version.
+
+    The file is replaced atomically so readers holding the previous one
+    mapped are not affected.
+    """
+
+    version = get_data_version('experiments')
+    data = build_snapshot(version)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as f:
+        f.write(data)
+    # Temporary files are private to their owner, the readers may run as others
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+    return version
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit(f'usage: {os.path.basename(sys.argv[0])} <snapshot path>')
+
+    setup_db()
+    version = write_snapshot(sys.argv[1])
+    print(f'Snapshot version {version} written to {sys.argv[1]}')
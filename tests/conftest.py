@@ -1,6 +1,7 @@
 import pytest
 from sqlalchemy import event
 
+import snapshot
 from api.app import create_app
 from db import db_models
 from tests.factories import ExperimentFactory
@@ -9,6 +10,21 @@ from tests.factories import TeamFactory
 test_factories = [ExperimentFactory, TeamFactory]
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        '--plans', action='store_true', help='run the query plan tests, on a large dataset'
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--plans'):
+        return
+    skip = pytest.mark.skip(reason='query plan tests only run with --plans')
+    for item in items:
+        if 'plans' in item.keywords:
+            item.add_marker(skip)
+
+
 def bind_test_session_to_factories(session):
     """Set factory session to the test's scoped session."""
 
@@ -35,6 +51,9 @@ def session():
         db_models.metadata.create_all(bind=db_models.engine)
 
         session = db_models.session
+        # Data versions restart along with the schema, drop what was cached
+        db_models.team_tree_cache.invalidate()
+        snapshot.snapshot_cache.invalidate()
 
         bind_test_session_to_factories(session=session)
 
@@ -67,3 +86,17 @@ def app():  # noqa
 @pytest.fixture()
 def client(app):
     return app.test_client()
+
+
+@pytest.fixture()
+def sql_statements():
+    """Collect the SQL statements sent to the database while in use."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_models.engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(db_models.engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,56 @@
+from collections import Counter
+
+import numpy as np
+
+import assignment
+
+
+def test_assign():
+    """Test unit assignment is stable and follows the sample ratio."""
+
+    assert assignment.assign(1, 50, 'user-1') == assignment.assign(1, 50, 'user-1')
+    assert assignment.bucket(1, 42) == assignment.bucket(1, 42)
+    # negative ids are keyed by their 64-bit two's complement
+    assert assignment.bucket(1, -1) == assignment.bucket(1, (1 << 64) - 1)
+
+    units = range(20000)
+
+    assert all(assignment.assign(1, 0, unit) is None for unit in units)
+    assert all(assignment.assign(1, 100, unit) is not None for unit in units)
+
+    variants = Counter(assignment.assign(1, 30, unit) for unit in units)
+    assert abs(variants[None] / len(units) - 0.7) < 0.02
+    assert abs(variants['control'] / len(units) - 0.15) < 0.02
+    assert abs(variants['treatment'] / len(units) - 0.15) < 0.02
+
+    # a unit in the sample stays in when the sample grows
+    assert all(
+        assignment.assign(1, 30, unit) == assignment.assign(1, 60, unit)
+        for unit in units
+        if assignment.assign(1, 30, unit)
+    )
+
+    # buckets are independent between experiments
+    same_bucket = sum(assignment.bucket(1, unit) == assignment.bucket(2, unit) for unit in units)
+    assert same_bucket / len(units) < 0.02
+
+
+def test_assign_many():
+    """Test vectorized assignment matches unit by unit assignment."""
+
+    experiments = [(1, 30), (2, 100), (3, 0)]
+    unit_ids = np.array([0, 1, -1, 42, 2**62, -(2**63), *range(1000)], dtype=np.int64)
+
+    matrix = assignment.assign_many(experiments, unit_ids)
+
+    assert matrix.shape == (3, len(unit_ids))
+    assert matrix.dtype == np.uint8
+    for row, (experiment_id, sample_ratio) in enumerate(experiments):
+        variants = [
+            assignment.assign(experiment_id, sample_ratio, int(unit_id)) for unit_id in unit_ids
+        ]
+        expected = [
+            0 if variant is None else assignment.VARIANTS.index(variant) + 1
+            for variant in variants
+        ]
+        assert matrix[row].tolist() == expected
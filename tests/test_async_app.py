@@ -0,0 +1,40 @@
+import pytest
+from starlette.testclient import TestClient
+
+from api.async_app import create_async_app
+from tests.factories import ExperimentFactory
+from tests.factories import TeamFactory
+
+
+@pytest.fixture()
+def async_client(app):
+    with TestClient(create_async_app(app)) as client:
+        yield client
+
+
+def test_get_experiments_async(client, async_client, session):
+    """Test the async listing matches the WSGI one, and other routes are still served."""
+
+    parent, child, other = TeamFactory.create_batch(3)
+    child.parent_team_id = parent.id
+    ExperimentFactory.create_batch(3, teams=[child])
+    ExperimentFactory.create_batch(2, teams=[other])
+    session.commit()
+
+    for qs in ({}, {"team_ids[]": [parent.id]}, {"sort_by": "sample_ratio", "limit": 2}):
+        expected = client.get('/experiments', query_string=qs)
+        ret = async_client.get('/experiments', params=qs)
+        assert ret.status_code == 200
+        assert ret.content == expected.data
+        assert ret.headers['ETag'] == expected.headers['ETag']
+
+        ret = async_client.get(
+            '/experiments', params=qs, headers={'If-None-Match': ret.headers['ETag']}
+        )
+        assert ret.status_code == 304
+
+    ret = async_client.get('/experiments', params={"team_ids[]": ["nope"]})
+    assert ret.status_code == 400
+
+    ret = async_client.post('/teams', json={"name": "async"})
+    assert ret.status_code == 201
@@ -0,0 +1,52 @@
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy import select
+
+from benchmarks.datagen import generate
+from benchmarks.datagen import team_parents
+from db import db_models
+from db.db_models import Experiment
+from db.db_models import Team
+from db.db_models import paths_related
+from db.db_models import team_closure
+
+
+def test_team_parents():
+    """Test generated hierarchies have the requested shape."""
+
+    rng = np.random.default_rng(0)
+    parents = team_parents(1000, 5, 10, rng)
+
+    assert (parents[:10] == -1).all()
+    assert (parents[10:] >= 0).all()
+    assert (parents < np.arange(1000)).all()
+
+    depths = np.zeros(1000, dtype=int)
+    for team, parent in enumerate(parents):
+        if parent >= 0:
+            depths[team] = depths[parent] + 1
+    assert depths.max() == 4
+
+
+def test_generate(session):
+    """Test generated datasets are consistent and follow the API rules."""
+
+    connection = db_models.engine.raw_connection()
+    try:
+        generate(connection, teams=200, experiments=1000, depth=4, roots=5)
+    finally:
+        connection.close()
+
+    assert session.scalar(select(func.count(Team.id))) == 200
+    assert session.scalar(select(func.count(Experiment.id))) == 1000
+    assert session.scalar(select(func.count()).select_from(team_closure)) > 200
+
+    paths = dict(session.execute(select(Team.id, Team.path)).all())
+    team_ids = session.scalars(select(Experiment.team_ids)).all()
+    assert {len(ids) for ids in team_ids} == {1, 2}
+    assert not any(paths_related(paths[team_id] for team_id in ids) for ids in team_ids)
+
+    # sequences continue after the generated ids
+    session.add(Team(name='next'))
+    session.flush()
+    assert session.scalar(select(func.max(Team.id))) == 201
@@ -1,5 +1,15 @@
+import json
+import threading
 from unittest.mock import ANY
 
+import numpy as np
+from sqlalchemy import text
+
+import assignment
+from api import resources
+from api import serialization
+from db import db_models
+from db.cache import LRUCache
 from tests.factories import ExperimentFactory
 from tests.factories import TeamFactory
 
@@ -43,6 +53,18 @@ def test_create_experiment(client, faker):
     # valid
     team = TeamFactory()
 
+    # Teams descending from one another
+    child = TeamFactory(parent_team_id=team.id)
+    payload = {
+        "description": faker.pystr(),
+        "sample_ratio": faker.pyint(min_value=0, max_value=100),
+        "team_ids": [team.id, child.id],
+    }
+
+    ret = client.post('/experiments', json=payload)
+    assert ret.status_code == 400
+    assert ret.json == 'Experiment teams cannot be descendents of one another'
+
     payload = {
         "description": faker.pystr(),
         "sample_ratio": faker.pyint(min_value=0, max_value=100),
@@ -59,7 +81,84 @@ def test_create_experiment(client, faker):
     }
 
 
-def test_get_experiments(client):
+def test_create_experiments_batch(client, faker):
+    """Test creating experiments in bulk."""
+
+    parent, child, other = TeamFactory.create_batch(3)
+    child.parent_team_id = parent.id
+
+    def payload(team_ids):
+        return {
+            "description": faker.pystr(),
+            "sample_ratio": faker.pyint(min_value=0, max_value=100),
+            "team_ids": team_ids,
+        }
+
+    ret = client.post('/experiments:batch', json={"experiments": []})
+    assert ret.status_code == 400
+    assert ret.json == {'experiments': ['Length must be between 1 and 10000.']}
+
+    # errors are reported per experiment and nothing gets created
+    experiments = [
+        payload([parent.id, other.id]),
+        {"description": faker.pystr()},
+        payload([other.id + 1]),
+        payload([parent.id, child.id]),
+    ]
+    ret = client.post('/experiments:batch', json={"experiments": experiments})
+    assert ret.status_code == 400
+    assert ret.json == {
+        'experiments': {
+            '1': {
+                'sample_ratio': ['Missing data for required field.'],
+                'team_ids': ['Missing data for required field.'],
+            },
+        }
+    }
+
+    del experiments[1]
+    ret = client.post('/experiments:batch', json={"experiments": experiments})
+    assert ret.status_code == 400
+    assert ret.json == {
+        'experiments': {
+            '1': {'team_ids': ['Some/All of the teams specified were not found']},
+            '2': {'team_ids': ['Experiment teams cannot be descendents of one another']},
+        }
+    }
+    assert client.get('/experiments').json['data'] == []
+
+    # valid
+    experiments = [payload([parent.id, other.id]), payload([child.id])]
+    ret = client.post('/experiments:batch', json={"experiments": experiments})
+    assert ret.status_code == 201
+    assert ret.json == {
+        'data': [
+            {
+                'description': experiments[0]['description'],
+                'id': ANY,
+                'sample_ratio': experiments[0]['sample_ratio'],
+                'teams': [
+                    {'id': parent.id, 'name': parent.name},
+                    {'id': other.id, 'name': other.name},
+                ],
+            },
+            {
+                'description': experiments[1]['description'],
+                'id': ANY,
+                'sample_ratio': experiments[1]['sample_ratio'],
+                'teams': [{'id': child.id, 'name': child.name}],
+            },
+        ]
+    }
+
+    ret = client.get('/experiments', query_string={"team_ids[]": [parent.id]})
+    assert [exp['description'] for exp in ret.json['data']] == [
+        experiments[0]['description'],
+        experiments[1]['description'],
+    ]
+
+
+def test_get_experiments(client, session):
     """Test experiment listing."""
 
     e1, e2, e3, e4 = ExperimentFactory.create_batch(4)
@@ -79,6 +178,7 @@ def test_get_experiments(client):
         'order_by': 'asc',
         'page': 1,
         'sort_by': 'id',
+        'next_cursor': None,
     }
 
     # custom pagination/sorting
@@ -94,6 +194,7 @@ def test_get_experiments(client):
         'order_by': 'desc',
         'page': 2,
         'sort_by': 'id',
+        'next_cursor': ANY,
     }
 
     # filter by team_ids
@@ -130,6 +231,8 @@ def test_get_experiments(client):
     t3.parent_team_id = parent_team.id
     # create an experiment linked to the parent
     pe = ExperimentFactory(teams=[parent_team])
+    # the team tree version moves on commit
+    session.commit()
 
     # Fetching experiment for parent team should give us back experiment of t1, t2, t3
     qs = {"team_ids[]": [parent_team.id]}
@@ -186,6 +289,179 @@ def test_get_experiments(client):
     ]
 
 
+def test_get_experiments_serialization(app, client, session, monkeypatch):
+    """Test listings are byte for byte the marshmallow dump encoded by the app."""
+
+    t1, t2 = TeamFactory(name='"team" \\ 1'), TeamFactory(name='</script>')
+    e1 = ExperimentFactory(description='snow\nman\t\x7f', teams=[t2, t1])
+    e2 = ExperimentFactory(teams=[t1])
+    ExperimentFactory()
+    session.commit()
+
+    qs = {"limit": 2}
+    ret = client.get('/experiments', query_string=qs)
+    assert ret.status_code == 200
+
+    meta = ret.json['meta']
+    data = resources.ExperimentSchema(many=True).dump([e1, e2])
+    for experiment in data:
+        experiment['teams'].sort(key=lambda team: team['id'])
+    assert ret.data == app.json.response({"data": data, "meta": meta}).get_data()
+
+    # indented in debug mode
+    monkeypatch.setattr(app, 'debug', True)
+    ret = client.get('/experiments', query_string=qs)
+    assert b'\n  "data": [' in ret.data
+    assert ret.data == app.json.response({"data": data, "meta": meta}).get_data()
+
+    # non ASCII text is escaped the same way
+    teams = {1: serialization.team_json(1, 'ünïcode')}
+    body = serialization.experiments_json([(2, '\u2603 \U0001f600', 3, [1])], teams)
+    assert body == app.json.dumps(
+        [
+            {
+                'description': '\u2603 \U0001f600',
+                'id': 2,
+                'sample_ratio': 3,
+                'teams': [{'id': 1, 'name': 'ünïcode'}],
+            }
+        ],
+        separators=(',', ':'),
+    )
+
+
+def test_get_experiments_cursor(client):
+    """Test experiment listing with keyset pagination."""
+
+    e1, e2, e3, e4, e5 = ExperimentFactory.create_batch(5)
+    e1.sample_ratio, e2.sample_ratio, e3.sample_ratio = 10, 30, 10
+    e4.sample_ratio, e5.sample_ratio = 20, 20
+
+    # Walk the whole list page by page following the cursors
+    for qs, expected in [
+        ({"limit": 2}, [e1.id, e2.id, e3.id, e4.id, e5.id]),
+        ({"limit": 2, "order_by": "desc"}, [e5.id, e4.id, e3.id, e2.id, e1.id]),
+        ({"limit": 2, "sort_by": "sample_ratio"}, [e1.id, e3.id, e4.id, e5.id, e2.id]),
+        (
+            {"limit": 2, "sort_by": "sample_ratio", "order_by": "desc"},
+            [e2.id, e5.id, e4.id, e3.id, e1.id],
+        ),
+    ]:
+        ids = []
+        while True:
+            ret = client.get('/experiments', query_string=qs)
+            assert ret.status_code == 200
+            ids.extend(exp["id"] for exp in ret.json["data"])
+            if not (cursor := ret.json['meta']['next_cursor']):
+                break
+            qs = {**qs, "cursor": cursor}
+
+        assert ids == expected
+
+    # Cursors are bound to the ordering they were issued for
+    ret = client.get('/experiments', query_string={"limit": 2})
+    cursor = ret.json['meta']['next_cursor']
+
+    ret = client.get('/experiments', query_string={"cursor": cursor, "sort_by": "sample_ratio"})
+    assert ret.status_code == 400
+    assert ret.json == {'cursor': ['Invalid cursor.']}
+
+    ret = client.get('/experiments', query_string={"cursor": "not-a-cursor"})
+    assert ret.status_code == 400
+    assert ret.json == {'cursor': ['Invalid cursor.']}
+
+    # Forged keys never reach the database
+    for key in (["x", 1], [[1], 2], [None, 1], [1, True], [1.5, 1]):
+        cursor = resources.encode_cursor({"sort_by": "id", "order_by": "asc", "key": key})
+        ret = client.get('/experiments', query_string={"cursor": cursor})
+        assert ret.status_code == 400
+        assert ret.json == {'cursor': ['Invalid cursor.']}
+
+
+def test_get_experiments_total(client, session, monkeypatch):
+    """Test experiment listing with total counts."""
+
+    e1, e2, e3 = ExperimentFactory.create_batch(3)
+    parent, child, other = TeamFactory.create_batch(3)
+    child.parent_team_id = parent.id
+    e1.teams = [child]
+    e2.teams = [other]
+    session.flush()
+
+    # Only given when asked for
+    ret = client.get('/experiments', query_string={"limit": 2})
+    assert 'total' not in ret.json['meta']
+
+    ret = client.get('/experiments', query_string={"limit": 2, "with_total": "true"})
+    assert ret.status_code == 200
+    assert ret.json['meta']['items'] == 2
+    assert ret.json['meta']['total'] == 3
+    assert ret.json['meta']['total_estimated'] is False
+
+    # The total does not depend on the page
+    cursor = ret.json['meta']['next_cursor']
+    ret = client.get('/experiments', query_string={"with_total": "true", "cursor": cursor})
+    assert ret.json['meta']['items'] == 1
+    assert ret.json['meta']['total'] == 3
+
+    ret = client.get(
+        '/experiments', query_string={"with_total": "true", "team_ids[]": [parent.id]}
+    )
+    assert ret.json['meta']['total'] == 1
+    assert ret.json['meta']['total_estimated'] is False
+
+    # Past the threshold, unfiltered totals are the planner's estimate
+    session.execute(text('ANALYZE experiment'))
+    monkeypatch.setattr(resources, 'LISTING_TOTAL_ESTIMATE_THRESHOLD', 0)
+
+    ret = client.get('/experiments', query_string={"with_total": "true"})
+    assert ret.json['meta']['total'] == 3
+    assert ret.json['meta']['total_estimated'] is True
+
+    ret = client.get(
+        '/experiments', query_string={"with_total": "true", "team_ids[]": [parent.id]}
+    )
+    assert ret.json['meta']['total'] == 1
+    assert ret.json['meta']['total_estimated'] is False
+
+
+def test_export_experiments(client):
+    """Test streaming the experiments export."""
+
+    t1, t2 = TeamFactory.create_batch(2)
+    e1, e2, e3 = ExperimentFactory.create_batch(3)
+    e1.teams = [t1]
+    e2.teams = [t2]
+    e3.teams = [t1, t2]
+
+    ret = client.get('/experiments/export', query_string={"order_by": "desc"})
+    assert ret.status_code == 200
+    assert ret.mimetype == 'application/x-ndjson'
+
+    lines = ret.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [e3.id, e2.id, e1.id]
+    assert json.loads(lines[0]) == {
+        'description': e3.description,
+        'id': e3.id,
+        'sample_ratio': e3.sample_ratio,
+        'teams': [
+            {'id': t1.id, 'name': t1.name},
+            {'id': t2.id, 'name': t2.name},
+        ],
+    }
+
+    # same filters as the listing
+    ret = client.get('/experiments/export', query_string={"team_ids[]": [t1.id]})
+    assert ret.status_code == 200
+    assert [json.loads(line)["id"] for line in ret.get_data(as_text=True).splitlines()] == [
+        e1.id,
+        e3.id,
+    ]
+
+    ret = client.get('/experiments/export', query_string={"team_ids[]": ["x"]})
+    assert ret.status_code == 400
+
+
 def test_update_experiment(client):
     """Test update experiment teams."""
 
@@ -246,4 +522,216 @@ def test_update_experiment(client):
     assert ret.json == 'Experiment teams cannot be descendents of one another'
 
 
+def test_update_experiments_teams(client):
+    """Test bulk reassignment of experiment teams."""
+
+    t1, t2, t3, t3_child = TeamFactory.create_batch(4)
+    t3_child.parent_team_id = t3.id
+    e1 = ExperimentFactory(teams=[t1])
+    e2 = ExperimentFactory(teams=[t1, t2])
+    e3 = ExperimentFactory(teams=[t2])
+
+    ret = client.patch('/experiments/teams', json={})
+    assert ret.status_code == 400
+    assert ret.json == {'_schema': ['Exactly one of `assignments` or `replace` is required.']}
+
+    # rules of single experiment updates apply, nothing gets updated on error
+    payload = {
+        "assignments": [
+            {"experiment_id": e1.id, "team_ids": [t2.id]},
+            {"experiment_id": e2.id, "team_ids": [t3.id]},
+            {"experiment_id": e3.id, "team_ids": [t3_child.id + 1]},
+            {"experiment_id": e3.id + 1, "team_ids": [t1.id]},
+        ]
+    }
+    ret = client.patch('/experiments/teams', json=payload)
+    assert ret.status_code == 400
+    assert ret.json == {
+        'experiments': {
+            str(e2.id): 'Cannot change number of linked teams now',
+            str(e3.id): 'Some/All of the teams specified were not found',
+            str(e3.id + 1): 'Experiment not found!',
+        }
+    }
+
+    payload = {"assignments": [{"experiment_id": e2.id, "team_ids": [t3.id, t3_child.id]}]}
+    ret = client.patch('/experiments/teams', json=payload)
+    assert ret.status_code == 400
+    assert ret.json == {
+        'experiments': {str(e2.id): 'Experiment teams cannot be descendents of one another'}
+    }
+
+    # explicit assignments
+    payload = {
+        "assignments": [
+            {"experiment_id": e1.id, "team_ids": [t2.id]},
+            {"experiment_id": e2.id, "team_ids": [t1.id, t3.id]},
+            {"experiment_id": e3.id, "team_ids": [t2.id]},
+        ]
+    }
+    ret = client.patch('/experiments/teams', json=payload)
+    assert ret.status_code == 200
+    # only changed experiments are reported
+    assert ret.json == {
+        'data': [
+            {
+                'description': e1.description,
+                'id': e1.id,
+                'sample_ratio': e1.sample_ratio,
+                'teams': [{'id': t2.id, 'name': t2.name}],
+            },
+            {
+                'description': e2.description,
+                'id': e2.id,
+                'sample_ratio': e2.sample_ratio,
+                'teams': [{'id': t1.id, 'name': t1.name}, {'id': t3.id, 'name': t3.name}],
+            },
+        ]
+    }
+
+    # replace a team everywhere
+    payload = {"replace": {"team_id": t2.id, "with_team_id": t3_child.id}}
+    ret = client.patch('/experiments/teams', json=payload)
+    assert ret.status_code == 200
+    assert [exp['id'] for exp in ret.json['data']] == [e1.id, e3.id]
+
+    ret = client.get('/experiments', query_string={"team_ids[]": [t3_child.id]})
+    assert [exp['id'] for exp in ret.json['data']] == [e1.id, e3.id]
+
+    # t3_child cannot join t3 on e2
+    payload = {"replace": {"team_id": t1.id, "with_team_id": t3_child.id}}
+    ret = client.patch('/experiments/teams', json=payload)
+    assert ret.status_code == 400
+    assert ret.json == {
+        'experiments': {str(e2.id): 'Experiment teams cannot be descendents of one another'}
+    }
+
+
+def test_update_experiment_concurrent_move(client, session):
+    """Test the teams of an experiment are checked against a concurrent team move."""
 
+    x, y, z = TeamFactory.create_batch(3)
+    e = ExperimentFactory(teams=[x, z])
+    session.commit()
+
+    responses = []
+    with db_models.engine.connect() as connection:
+        # X moves below Y, not committed yet
+        connection.execute(
+            text("UPDATE team SET parent_team_id = :y WHERE id = :x"), {"y": y.id, "x": x.id}
+        )
+
+        update = threading.Thread(
+            target=lambda: responses.append(
+                client.put(f'/experiments/{e.id}', json={"team_ids": [x.id, y.id]})
+            )
+        )
+        update.start()
+        update.join(timeout=0.5)
+        assert update.is_alive()
+
+        connection.commit()
+
+    update.join()
+    assert responses[0].status_code == 400
+    assert responses[0].json == 'Experiment teams cannot be descendents of one another'
+
+
+def test_assign_experiment(client):
+    """Test assigning a unit to an experiment."""
+
+    e = ExperimentFactory(sample_ratio=100)
+
+    ret = client.post(f'/experiments/{e.id}/assign', json={"unit_id": 1.5})
+    assert ret.status_code == 400
+    assert ret.json == {'unit_id': ['Not a valid unit id.']}
+
+    ret = client.post(f'/experiments/{e.id + 1}/assign', json={"unit_id": 42})
+    assert ret.status_code == 404
+    assert ret.json == 'Experiment not found!'
+
+    for unit_id in (42, 'user-42'):
+        ret = client.post(f'/experiments/{e.id}/assign', json={"unit_id": unit_id})
+        assert ret.status_code == 200
+        assert ret.json == {
+            'experiment_id': e.id,
+            'unit_id': unit_id,
+            'bucket': assignment.bucket(e.id, unit_id),
+            'variant': assignment.assign(e.id, e.sample_ratio, unit_id),
+        }
+        assert ret.json['variant'] in assignment.VARIANTS
+
+
+def test_assign_experiments(client):
+    """Test assigning many units to many experiments."""
+
+    e1 = ExperimentFactory(sample_ratio=40)
+    e2 = ExperimentFactory(sample_ratio=70)
+    unit_ids = np.arange(-500, 500, dtype='<i8')
+
+    ret = client.post('/experiments:assign', data=unit_ids.tobytes())
+    assert ret.status_code == 400
+    assert ret.json == {'experiment_ids[]': ['Missing data for required field.']}
+
+    qs = {"experiment_ids[]": [e2.id, e1.id]}
+
+    ret = client.post('/experiments:assign', query_string=qs, data=b'\x00' * 7)
+    assert ret.status_code == 400
+
+    ret = client.post(
+        '/experiments:assign',
+        query_string={"experiment_ids[]": [e1.id, e2.id + 1]},
+        data=unit_ids.tobytes(),
+    )
+    assert ret.status_code == 404
+    assert ret.json == {'experiment_ids[]': {str(e2.id + 1): 'Experiment not found!'}}
+
+    ret = client.post('/experiments:assign', query_string=qs, data=unit_ids.tobytes())
+    assert ret.status_code == 200
+    assert ret.headers['X-Experiment-Ids'] == f'{e2.id},{e1.id}'
+    assert ret.headers['X-Variants'] == 'control,treatment'
+
+    matrix = np.frombuffer(ret.data, dtype=np.uint8).reshape(2, len(unit_ids))
+    assert (matrix == assignment.assign_many([(e2.id, 70), (e1.id, 40)], unit_ids)).all()
+
+
+def test_get_experiments_etag(client, session, monkeypatch):
+    """Test conditional listing requests and the listing cache."""
+
+    monkeypatch.setattr(resources, 'listing_cache', LRUCache(10))
+
+    t1 = TeamFactory()
+    e1 = ExperimentFactory(teams=[t1])
+
+    ret = client.get('/experiments')
+    assert ret.status_code == 200
+    etag = ret.headers['ETag']
+
+    # unchanged data
+    ret = client.get('/experiments', headers={'If-None-Match': etag})
+    assert ret.status_code == 304
+    assert ret.headers['ETag'] == etag
+
+    # served from the cache
+    cached = client.get('/experiments')
+    assert cached.headers['ETag'] == etag
+    assert cached.data == client.get('/experiments').data
+    assert resources.listing_cache.get(etag.strip('"')) == cached.data
+
+    # different query args, different tag
+    ret = client.get('/experiments', query_string={"team_ids[]": [t1.id]})
+    assert ret.headers['ETag'] != etag
+
+    # experiment, team assignment and team hierarchy changes are all picked up
+    for change in (
+        lambda: setattr(e1, 'sample_ratio', e1.sample_ratio + 1),
+        lambda: e1.teams.append(TeamFactory()),
+        lambda: TeamFactory(parent_team_id=t1.id),
+    ):
+        change()
+        session.commit()
+
+        ret = client.get('/experiments', headers={'If-None-Match': etag})
+        assert ret.status_code == 200
+        assert ret.headers['ETag'] != etag
+        etag = ret.headers['ETag']
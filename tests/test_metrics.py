@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import text as sql_text
+from sqlalchemy.exc import DBAPIError
+
+from db import db_models
+from tests.factories import ExperimentFactory
+from tests.factories import TeamFactory
+
+
+def test_metrics(client, session):
+    """Test requests are accounted per route, along with their SQL and serialization."""
+
+    ExperimentFactory.create_batch(2, teams=TeamFactory.create_batch(2))
+    session.commit()
+
+    assert client.get('/experiments').status_code == 200
+    assert client.get('/experiments', query_string={"team_ids[]": ["nope"]}).status_code == 400
+
+    ret = client.get('/metrics')
+    assert ret.status_code == 200
+    text = ret.get_data(as_text=True)
+
+    for sample in (
+        'http_request_duration_seconds_count{method="GET",route="/experiments",status="200"}',
+        'http_request_duration_seconds_count{method="GET",route="/experiments",status="400"}',
+        'sql_request_statements_count{route="/experiments"}',
+        'sql_statement_duration_seconds_count{route="/experiments"}',
+        'serialization_duration_seconds_count{serializer="experiment_listing"}',
+        'serialization_duration_seconds_count{serializer="json"}',
+        'db_pool_checkout_wait_seconds_count',
+    ):
+        assert sample in text
+
+
+def test_failed_statement_timing(session):
+    """Test failed statements do not leave their start time on the connection."""
+
+    with db_models.engine.connect() as connection:
+        connection.execute(sql_text("SELECT 1"))
+        with pytest.raises(DBAPIError):
+            connection.execute(sql_text("SELECT 1 / 0"))
+        connection.rollback()
+
+        assert connection.info['query_start'] == []
@@ -1,3 +1,19 @@
+import random
+import threading
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from db import db_models
+from db.cache import LRUCache
+from db.db_models import Experiment
+from db.db_models import Team
+from db.db_models import get_data_versions
+from db.db_models import get_team_tree
+from db.db_models import is_ancestor_path
+from db.db_models import paths_related
 from tests.factories import ExperimentFactory
 from tests.factories import TeamFactory
 
@@ -14,3 +30,238 @@ def test_experiment_team_relationship():
     assert len(t1.experiments) == 1
     assert len(t2.experiments) == 2
     assert len(t3.experiments) == 1
+
+
+def test_team_closure(session):
+    """Test the team closure follows team creation and re-parenting."""
+
+    root, other_root = TeamFactory.create_batch(2)
+    child = TeamFactory(parent_team_id=root.id)
+    grandchild = TeamFactory(parent_team_id=child.id)
+
+    assert sorted(Team.get_all_sub_teams((root.id,))) == [child.id, grandchild.id]
+    assert Team.get_all_sub_teams((grandchild.id,)) == []
+    assert paths_related([root.path, grandchild.path])
+    assert not paths_related([other_root.path, grandchild.path])
+
+    # move the child subtree below the other root
+    child.parent_team_id = other_root.id
+    session.commit()
+
+    assert Team.get_all_sub_teams((root.id,)) == []
+    assert sorted(Team.get_all_sub_teams((other_root.id,))) == [child.id, grandchild.id]
+    assert not paths_related([root.path, grandchild.path])
+    assert paths_related([other_root.path, grandchild.path])
+
+    # cycles are refused whatever the path of the update
+    grandchild.parent_team_id = grandchild.id
+    with pytest.raises(IntegrityError, match='cannot be moved below'):
+        session.flush()
+    session.rollback()
+
+
+def test_team_path(session):
+    """Test team paths follow team creation and re-parenting, subtrees included."""
+
+    root, other_root = TeamFactory.create_batch(2)
+    child = TeamFactory(parent_team_id=root.id)
+    grandchild = TeamFactory(parent_team_id=child.id)
+
+    assert root.path == [root.id]
+    assert grandchild.path == [root.id, child.id, grandchild.id]
+    assert is_ancestor_path(root.path, grandchild.path)
+    assert is_ancestor_path(child.path, grandchild.path)
+    assert not is_ancestor_path(grandchild.path, child.path)
+    assert not is_ancestor_path(child.path, child.path)
+    assert not is_ancestor_path(other_root.path, grandchild.path)
+    assert paths_related([other_root.path, child.path, grandchild.path])
+    assert not paths_related([other_root.path, grandchild.path])
+
+    # move the child subtree below the other root
+    child.parent_team_id = other_root.id
+    session.flush()
+    session.expire_all()
+
+    assert child.path == [other_root.id, child.id]
+    assert grandchild.path == [other_root.id, child.id, grandchild.id]
+    assert not is_ancestor_path(root.path, grandchild.path)
+    assert is_ancestor_path(other_root.path, grandchild.path)
+
+
+def test_team_path_statement_moves(session):
+    """Test team paths follow statements moving many teams at once."""
+
+    rng = random.Random(0)
+    teams = TeamFactory.create_batch(30)
+    session.flush()
+    ids = [team.id for team in teams]
+
+    paths_query = text(
+        """
+        SELECT t.path, array_agg(c.ancestor_id ORDER BY c.depth DESC)
+        FROM team t JOIN team_closure c ON c.descendant_id = t.id
+        GROUP BY t.id
+        """
+    )
+    for _ in range(50):
+        moves = [
+            {"id": team_id, "parent": rng.choice([None, *ids])}
+            for team_id in rng.sample(ids, rng.randint(2, 5))
+        ]
+        values = ', '.join(f'(:id_{i}, CAST(:parent_{i} AS INT))' for i in range(len(moves)))
+        statement = text(
+            f"""
+            UPDATE team SET parent_team_id = v.parent
+            FROM (VALUES {values}) AS v (id, parent)
+            WHERE team.id = v.id
+            """
+        )
+        parameters = {
+            f'{key}_{i}': move[key] for i, move in enumerate(moves) for key in ('id', 'parent')
+        }
+
+        savepoint = session.begin_nested()
+        try:
+            session.execute(statement, parameters)
+        except IntegrityError:
+            # moves creating a cycle are refused
+            savepoint.rollback()
+            continue
+        savepoint.commit()
+
+        for path, closure_path in session.execute(paths_query):
+            assert path == closure_path
+
+
+def test_team_path_concurrent_moves(session):
+    """Test a team path follows a concurrent move of its new ancestors."""
+
+    c, b, a = TeamFactory.create_batch(3)
+    session.commit()
+
+    def move(connection, team, parent):
+        connection.execute(
+            text("UPDATE team SET parent_team_id = :parent WHERE id = :id"),
+            {"parent": parent.id, "id": team.id},
+        )
+
+    def move_b_below_c():
+        with db_models.engine.connect() as connection:
+            move(connection, b, c)
+            connection.commit()
+
+    with db_models.engine.connect() as connection:
+        # A below B, not committed yet
+        move(connection, a, b)
+
+        # B below C waits for it, or the path of A would miss C
+        thread = threading.Thread(target=move_b_below_c)
+        thread.start()
+        thread.join(timeout=0.5)
+        assert thread.is_alive()
+
+        connection.commit()
+
+    thread.join()
+    session.expire_all()
+    assert a.path == [c.id, b.id, a.id]
+
+
+def test_team_tree_cache(session):
+    """Test the in-process team tree is only reloaded when the hierarchy changes."""
+
+    # versions move on commit
+    root = TeamFactory()
+    session.commit()
+    tree = get_team_tree()
+
+    ExperimentFactory(teams=[root])
+    session.commit()
+    assert get_team_tree() is tree
+
+    child = TeamFactory(parent_team_id=root.id)
+    session.commit()
+    assert get_team_tree() is not tree
+    assert Team.get_all_sub_teams((root.id,)) == [child.id]
+
+
+def test_data_version_concurrent_writers(session):
+    """Test writers do not queue behind the data version, bumped once per commit."""
+
+    (version,) = get_data_versions('experiments')
+    session.commit()
+
+    first = db_models.engine.connect()
+    second = db_models.engine.connect()
+    try:
+        # the second writer would fail to wait on a row locked by the first one
+        for connection in (first, second):
+            connection.execute(text("SET lock_timeout = '1s'"))
+            for _ in range(2):
+                connection.execute(insert(Experiment).values(description='', sample_ratio=1))
+
+        assert get_data_versions('experiments') == (version,)
+        session.commit()
+
+        first.commit()
+        (first_version,) = get_data_versions('experiments')
+        session.commit()
+        assert first_version > version
+
+        second.commit()
+        (second_version,) = get_data_versions('experiments')
+        assert second_version == first_version + 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_data_version_monotonic(session):
+    """Test a commit moves its data version forward, even past a later sequence value."""
+
+    ExperimentFactory()
+    session.commit()
+
+    # as if a transaction that took a later version had committed first
+    session.execute(text("UPDATE data_version SET version = version + 1000"))
+    session.commit()
+    (version,) = get_data_versions('experiments')
+
+    ExperimentFactory()
+    session.commit()
+    assert get_data_versions('experiments') > (version,)
+
+
+def test_experiment_team_ids(session):
+    """Test the denormalized experiment team ids follow team assignments."""
+
+    t1, t2, t3 = TeamFactory.create_batch(3)
+    e = ExperimentFactory(teams=[t2, t1])
+
+    session.refresh(e, ['team_ids'])
+    assert e.team_ids == sorted([t1.id, t2.id])
+
+    e.teams = [t3]
+    session.flush()
+
+    session.refresh(e, ['team_ids'])
+    assert e.team_ids == [t3.id]
+
+
+def test_lru_cache():
+    """Test the LRU cache evicts the least recently used entries."""
+
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+    # disabled
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,220 @@
+"""
+Query plan regression tests, run with `--plans`.
+
+A large synthetic dataset is seeded once for the module, then the statements
+issued by the hot endpoints are captured and explained. A plan fails when it
+reads `experiment` or `experiments_teams` with a sequential scan while they
+hold more than `SEQ_SCAN_MAX_ROWS` rows, or when its estimated cost passes
+the budget of its scenario.
+"""
+import json
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import text
+
+import snapshot
+from benchmarks.datagen import generate
+from db import db_models
+from db.db_models import Experiment
+from db.db_models import Team
+
+pytestmark = pytest.mark.plans
+
+PLAN_TEAMS = 10_000
+PLAN_EXPERIMENTS = 200_000
+
+# Tables never to be read whole past that many rows
+SEQ_SCAN_TABLES = ('experiment', 'experiments_teams')
+SEQ_SCAN_MAX_ROWS = 10_000
+# Estimated total cost budget of any statement, per scenario
+DEFAULT_COST_BUDGET = 2_000
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    """Seed the large dataset, shared by the tests of the module."""
+
+    db_models.setup_db(engine=db_models._create_engine())
+    db_models.metadata.create_all(bind=db_models.engine)
+    db_models.team_tree_cache.invalidate()
+    snapshot.snapshot_cache.invalidate()
+
+    connection = db_models.engine.raw_connection()
+    try:
+        generate(connection, teams=PLAN_TEAMS, experiments=PLAN_EXPERIMENTS, depth=6)
+    finally:
+        connection.close()
+
+    yield
+
+    db_models.session.remove()
+    db_models.metadata.drop_all(bind=db_models.engine)
+
+
+@pytest.fixture()
+def session(dataset):
+    """Overrides the per test schema of `conftest.session`, the dataset is module wide."""
+
+    yield db_models.session
+    db_models.session.remove()
+
+
+@pytest.fixture()
+def captured_statements():
+    """Collect the (statement, parameters) sent to the database while in use."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(db_models.engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(db_models.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def explain(statement: str, parameters) -> dict:
+    with db_models.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters)
+        plan = rows.scalar()
+        conn.rollback()
+
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]['Plan']
+
+
+def plan_nodes(plan: dict):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+def check_plans(statements, cost_budget: int = DEFAULT_COST_BUDGET) -> list[str]:
+    """Return the problems of the plans of the statements, empty when all are fine."""
+
+    # explaining sends statements too, only check the ones captured so far
+    statements = list(statements)
+    session = db_models.get_session()
+    table_rows = dict(
+        session.execute(
+            text("SELECT relname, reltuples FROM pg_class WHERE relname = ANY(:names)"),
+            {'names': list(SEQ_SCAN_TABLES)},
+        ).all()
+    )
+
+    problems = []
+    for statement, parameters in statements:
+        plan = explain(statement, parameters)
+        summary = ' '.join(statement.split())[:200]
+
+        if plan['Total Cost'] > cost_budget:
+            problems.append(f"cost {plan['Total Cost']} > {cost_budget}: {summary}")
+        for node in plan_nodes(plan):
+            table = node.get('Relation Name')
+            if (
+                node['Node Type'] == 'Seq Scan'
+                and table in SEQ_SCAN_TABLES
+                and table_rows.get(table, 0) > SEQ_SCAN_MAX_ROWS
+            ):
+                problems.append(f'sequential scan on {table}: {summary}')
+
+    return problems
+
+
+# Teams of the generated hierarchy: a root, one in the middle, a leaf
+ROOT_TEAM_ID = 1
+MIDDLE_TEAM_ID = PLAN_TEAMS // 2
+LEAF_TEAM_ID = PLAN_TEAMS
+
+
+@pytest.mark.parametrize(
+    'query_string',
+    [
+        {},
+        {"page": 50},
+        {"sort_by": "sample_ratio"},
+        {"sort_by": "sample_ratio", "order_by": "desc", "page": 50},
+        {"team_ids[]": [LEAF_TEAM_ID]},
+        {"team_ids[]": [MIDDLE_TEAM_ID]},
+        {"team_ids[]": [ROOT_TEAM_ID]},
+        {"team_ids[]": [MIDDLE_TEAM_ID], "sort_by": "sample_ratio"},
+        {"team_ids[]": [MIDDLE_TEAM_ID], "with_total": "true"},
+        {"with_total": "true"},
+    ],
+)
+def test_get_experiments_plans(client, captured_statements, query_string):
+    """Test the plans of the statements listing experiments, a page and through a cursor."""
+
+    ret = client.get('/experiments', query_string=query_string)
+    assert ret.status_code == 200
+    next_cursor = ret.json['meta']['next_cursor']
+    assert next_cursor
+    assert not check_plans(captured_statements)
+
+    captured_statements.clear()
+    ret = client.get('/experiments', query_string={**query_string, "cursor": next_cursor})
+    assert ret.status_code == 200
+    assert not check_plans(captured_statements)
+
+
+def test_update_experiment_plans(client, session, captured_statements):
+    """Test the plans of the statements updating the teams of an experiment."""
+
+    experiment_id, (team_id,) = session.execute(
+        select(Experiment.id, Experiment.team_ids)
+        .where(func.cardinality(Experiment.team_ids) == 1)
+        .limit(1)
+    ).one()
+    new_team_id = session.scalar(select(Team.id).where(Team.id != team_id).limit(1))
+    session.close()
+
+    captured_statements.clear()
+    ret = client.put(f'/experiments/{experiment_id}', json={"team_ids": [new_team_id]})
+    assert ret.status_code == 200
+    assert not check_plans(captured_statements)
+
+
+def test_get_team_stats_plans(client, captured_statements):
+    """Test the plans of the statements reading team stats."""
+
+    ret = client.get(f'/teams/{ROOT_TEAM_ID}/stats')
+    assert ret.status_code == 200
+    assert ret.json['subtree_experiments']
+    assert not check_plans(captured_statements)
+
+
+@pytest.mark.parametrize(
+    'url, query_string',
+    [
+        ('/teams', {}),
+        ('/teams', {"sort_by": "name", "page": 50}),
+        (f'/teams/{ROOT_TEAM_ID}/subtree', {}),
+        (f'/teams/{ROOT_TEAM_ID}/subtree', {"max_depth": 2}),
+        (f'/teams/{MIDDLE_TEAM_ID}/subtree', {}),
+    ],
+)
+def test_get_teams_plans(client, captured_statements, url, query_string):
+    """Test the plans of the statements reading teams."""
+
+    ret = client.get(url, query_string=query_string)
+    assert ret.status_code == 200
+    assert not check_plans(captured_statements)
+
+
+def test_update_team_plans(client, session, captured_statements):
+    """Test the plans of the statements moving a team, and its subtree."""
+
+    parent_team_id = session.scalar(select(Team.parent_team_id).where(Team.id == MIDDLE_TEAM_ID))
+    session.close()
+
+    captured_statements.clear()
+    ret = client.patch(f'/teams/{MIDDLE_TEAM_ID}', json={"parent_team_id": ROOT_TEAM_ID})
+    assert ret.status_code in (200, 400)
+    assert not check_plans(captured_statements)
+
+    if ret.status_code == 200:
+        ret = client.patch(f'/teams/{MIDDLE_TEAM_ID}', json={"parent_team_id": parent_team_id})
+        assert ret.status_code == 200
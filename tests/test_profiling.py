@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from api import profiling
+from db import db_models
+from tests.factories import ExperimentFactory
+from tests.factories import TeamFactory
+
+
+def test_profile_request(client, session, tmp_path, monkeypatch):
+    """Test requests asking for it are profiled, only when enabled."""
+
+    parent, child = TeamFactory.create_batch(2)
+    child.parent_team_id = parent.id
+    ExperimentFactory.create_batch(2, teams=[child])
+    session.commit()
+    qs = {"team_ids[]": [parent.id]}
+
+    ret = client.get('/experiments', query_string=qs, headers={'X-Profile': '1'})
+    assert 'X-Profile-Id' not in ret.headers
+
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    assert 'X-Profile-Id' not in client.get('/experiments', query_string=qs).headers
+
+    ret = client.get('/experiments', query_string=qs, headers={'X-Profile': '1'})
+    assert ret.status_code == 200
+    report = json.loads((tmp_path / f"{ret.headers['X-Profile-Id']}.json").read_text())
+
+    assert report['route'] == '/experiments'
+    assert report['status'] == 200
+    assert report['wall_time'] > 0
+    assert 'get_experiments' in report['profile']
+    assert report['statements']
+    for statement in report['statements']:
+        assert statement['duration'] > 0
+        assert any('actual time' in line for line in statement['plan'])
+
+
+def test_slow_query_log(client, session, caplog, monkeypatch):
+    """Test statements over the threshold are logged with their route."""
+
+    ret = client.get('/experiments')
+    assert not [r for r in caplog.records if r.name == profiling.logger.name]
+
+    monkeypatch.setattr(profiling, 'SLOW_QUERY_THRESHOLD', 1e-6)
+    ret = client.get('/experiments')
+    assert ret.status_code == 200
+
+    messages = [r.getMessage() for r in caplog.records if r.name == profiling.logger.name]
+    assert messages
+    assert all('route /experiments' in message for message in messages)
+
+
+def test_failed_statement_profiling(session):
+    """Test failed statements do not leave their start time on the connection."""
+
+    with db_models.engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        with pytest.raises(DBAPIError):
+            connection.execute(text("SELECT 1 / 0"))
+        connection.rollback()
+
+        assert connection.info['profiling_start'] == []
@@ -0,0 +1,15 @@
+import pytest
+
+from api.server import check_database_connections
+from config import DATABASE_MAX_CONNECTIONS
+from config import SERVER_WORKERS
+
+
+def test_check_database_connections():
+    """Test the server refuses to start workers the database could not all serve."""
+
+    # the default workers fit both servers
+    check_database_connections(SERVER_WORKERS, engines=2)
+
+    with pytest.raises(SystemExit, match='DATABASE_MAX_CONNECTIONS'):
+        check_database_connections(DATABASE_MAX_CONNECTIONS + 1, engines=1)
@@ -0,0 +1,77 @@
+import pytest
+
+import assignment
+from snapshot import Snapshot
+from snapshot import compile_snapshot
+from snapshot import write_snapshot
+from tests.factories import ExperimentFactory
+from tests.factories import TeamFactory
+
+
+def test_compile_snapshot(tmp_path):
+    """Test reading back a compiled snapshot from a memory mapped file."""
+
+    path = tmp_path / 'snapshot.bin'
+    path.write_bytes(
+        compile_snapshot(7, [(1, 20, [3, 4], 'first'), (5, 100, [], ''), (9, 0, [2], 'ünïcode')])
+    )
+
+    snapshot = Snapshot.open(str(path))
+
+    assert snapshot.version == 7
+    assert len(snapshot) == 3
+    assert snapshot.sample_ratio(5) == 100
+    assert snapshot.experiment_team_ids(1).tolist() == [3, 4]
+    assert snapshot.experiment_team_ids(5).tolist() == []
+    assert snapshot.description(9) == 'ünïcode'
+    assert snapshot.assign(1, 'unit') == assignment.assign(1, 20, 'unit')
+    assert snapshot.assign(9, 'unit') is None
+    # records are views over the mapped file
+    assert not snapshot.records.flags.owndata
+
+    for experiment_id in (0, 4, 10):
+        with pytest.raises(KeyError):
+            snapshot.sample_ratio(experiment_id)
+
+    assert len(Snapshot(compile_snapshot(0, []))) == 0
+
+
+def test_get_snapshot(client, session, tmp_path):
+    """Test downloading the snapshot and polling it for changes."""
+
+    t1, t2 = TeamFactory.create_batch(2)
+    e1 = ExperimentFactory(teams=[t1, t2])
+    e2 = ExperimentFactory(teams=[t2])
+
+    ret = client.get('/snapshot')
+    assert ret.status_code == 200
+    version = int(ret.headers['X-Snapshot-Version'])
+
+    snapshot = Snapshot(ret.data)
+    assert snapshot.version == version
+    assert snapshot.records['id'].tolist() == [e1.id, e2.id]
+    assert snapshot.experiment_team_ids(e1.id).tolist() == sorted([t1.id, t2.id])
+    assert snapshot.sample_ratio(e2.id) == e2.sample_ratio
+    assert snapshot.description(e2.id) == e2.description
+
+    # nothing changed
+    ret = client.get('/snapshot', query_string={"since_version": version})
+    assert ret.status_code == 304
+
+    # team assignments are part of the snapshot
+    e2.teams = [t1]
+    session.commit()
+
+    ret = client.get('/snapshot', query_string={"since_version": version})
+    assert ret.status_code == 200
+    assert int(ret.headers['X-Snapshot-Version']) > version
+    assert Snapshot(ret.data).experiment_team_ids(e2.id).tolist() == [t1.id]
+
+    # the job writes the same snapshot to disk
+    path = tmp_path / 'snapshot.bin'
+    assert write_snapshot(str(path)) == int(ret.headers['X-Snapshot-Version'])
+    assert path.read_bytes() == ret.data
+    assert path.stat().st_mode & 0o777 == 0o644
+
+    ret = client.get('/snapshot', query_string={"since_version": "x"})
+    assert ret.status_code == 400
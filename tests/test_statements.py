@@ -0,0 +1,136 @@
+"""Number of SQL statements issued per endpoint, none should grow with the data."""
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+
+from db import db_models
+from tests.factories import ExperimentFactory
+from tests.factories import TeamFactory
+
+
+def setup_teams(session, client, experiments):
+    """Return the ids of a parent team and its two children, sharing many experiments."""
+
+    parent, t1, t2 = TeamFactory.create_batch(3)
+    t1.parent_team_id = t2.parent_team_id = parent.id
+    ExperimentFactory.create_batch(experiments, teams=[parent])
+    ExperimentFactory.create_batch(experiments, teams=[t1, t2])
+    session.commit()
+
+    team_ids = parent.id, t1.id, t2.id
+    # warm up the team tree and start from an empty identity map, like a fresh request
+    client.get('/experiments', query_string={"team_ids[]": [parent.id]})
+    session.expunge_all()
+
+    return team_ids
+
+
+def test_get_experiments_statements(client, session, sql_statements):
+    """Test listing experiments."""
+
+    for experiments in (1, 10):
+        parent_id, _, _ = setup_teams(session, client, experiments)
+
+        # data versions, page, teams of the page
+        sql_statements.clear()
+        ret = client.get('/experiments', query_string={"limit": 100})
+        assert ret.status_code == 200
+        assert len(sql_statements) == 3
+
+        # + team tree version
+        qs = {"team_ids[]": [parent_id]}
+        sql_statements.clear()
+        ret = client.get('/experiments', query_string=qs)
+        assert ret.json['meta']['items'] == 2 * experiments
+        assert len(sql_statements) == 4
+
+        # data versions only
+        sql_statements.clear()
+        ret = client.get(
+            '/experiments', query_string=qs, headers={'If-None-Match': ret.headers['ETag']}
+        )
+        assert ret.status_code == 304
+        assert len(sql_statements) == 1
+
+
+def test_create_experiment_statements(client, session, sql_statements):
+    """Test creating an experiment."""
+
+    for experiments in (1, 10):
+        _, t1_id, t2_id = setup_teams(session, client, experiments)
+
+        # team move lock, teams, experiment, team links
+        sql_statements.clear()
+        payload = {"description": "desc", "sample_ratio": 10, "team_ids": [t1_id, t2_id]}
+        ret = client.post('/experiments', json=payload)
+        assert ret.status_code == 201
+        assert len(sql_statements) == 4
+
+
+def test_update_experiment_statements(client, session, sql_statements):
+    """Test updating the teams of an experiment."""
+
+    for experiments in (1, 10):
+        other_id = TeamFactory().id
+        parent_id, t1_id, t2_id = setup_teams(session, client, experiments)
+        ret = client.post(
+            '/experiments',
+            json={"description": "desc", "sample_ratio": 10, "team_ids": [t1_id, t2_id]},
+        )
+        experiment_id = ret.json['id']
+        session.expunge_all()
+
+        # team move lock, experiment, its teams, new teams with their paths, removed and
+        # added team links
+        sql_statements.clear()
+        ret = client.put(f'/experiments/{experiment_id}', json={"team_ids": [t1_id, other_id]})
+        assert ret.status_code == 200
+        assert len(sql_statements) == 6
+
+
+def test_create_team_statements(client, session, sql_statements):
+    """Test creating a team."""
+
+    for experiments in (1, 10):
+        parent_id, _, _ = setup_teams(session, client, experiments)
+
+        # parent, team
+        sql_statements.clear()
+        ret = client.post(
+            '/teams', json={"name": f"child-{experiments}", "parent_team_id": parent_id}
+        )
+        assert ret.status_code == 201
+        assert len(sql_statements) == 2
+
+
+def test_read_replica_routing(client, session, sql_statements, monkeypatch):
+    """Test reads of read-only requests go to the replica, anything else to the primary."""
+
+    replica = create_engine(db_models.engine.url)
+    replica_statements = []
+
+    @event.listens_for(replica, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        replica_statements.append(statement)
+
+    monkeypatch.setattr(session(), 'replica', replica)
+    _, t1_id, t2_id = setup_teams(session, client, 1)
+
+    replica_statements.clear()
+    sql_statements.clear()
+    ret = client.get('/experiments')
+    assert ret.status_code == 200
+    assert replica_statements and not sql_statements
+
+    replica_statements.clear()
+    ret = client.post('/experiments/1/assign', json={'unit_id': 1})
+    assert replica_statements and not sql_statements
+
+    replica_statements.clear()
+    payload = {"description": "desc", "sample_ratio": 10, "team_ids": [t1_id, t2_id]}
+    ret = client.post('/experiments', json=payload)
+    assert ret.status_code == 201
+    assert sql_statements and not replica_statements
+
+    session.rollback()
+    replica.dispose()
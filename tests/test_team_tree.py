@@ -0,0 +1,18 @@
+from db.team_tree import TeamTree
+
+
+def test_team_tree():
+    """Test the pre-order intervals of the in-memory team hierarchy."""
+
+    # 1 ─┬─ 2         6 ── 7
+    #    └─ 3 ─┬─ 4
+    #          └─ 5
+    tree = TeamTree([(1, None), (2, 1), (3, 1), (4, 3), (5, 3), (6, None), (7, 6)])
+
+    assert sorted(tree.sub_teams([1])) == [2, 3, 4, 5]
+    assert sorted(tree.sub_teams([3])) == [4, 5]
+    assert tree.sub_teams([2]) == []
+    # overlapping subtrees are only reported once
+    assert sorted(tree.sub_teams([1, 3, 6])) == [2, 3, 4, 5, 7]
+    # unknown teams have no descendants
+    assert tree.sub_teams([42]) == []
@@ -1,5 +1,11 @@
+import threading
 from unittest.mock import ANY
 
+from sqlalchemy import text
+
+from api import resources
+from db import db_models
+from tests.factories import ExperimentFactory
 from tests.factories import TeamFactory
 
 
@@ -28,3 +34,283 @@ def test_create_team(client, faker):
     ret = client.post('/teams', json=payload)
     assert ret.status_code == 400
     assert ret.json == 'Team already exists'
+
+
+def test_get_team_stats(client, session):
+    """Test the experiment counts of teams follow experiment writes."""
+
+    root, other = TeamFactory.create_batch(2)
+    left = TeamFactory(parent_team_id=root.id)
+    right = TeamFactory(parent_team_id=root.id)
+
+    def stats(team):
+        ret = client.get(f'/teams/{team.id}/stats')
+        assert ret.status_code == 200
+        return ret.json['experiments'], ret.json['subtree_experiments']
+
+    assert stats(root) == (0, 0)
+
+    ret = client.post(
+        '/experiments',
+        json={"description": "both", "sample_ratio": 50, "team_ids": [left.id, right.id]},
+    )
+    experiment_id = ret.json['id']
+    client.post(
+        '/experiments', json={"description": "root", "sample_ratio": 50, "team_ids": [root.id]}
+    )
+
+    # counted once in the subtree, even though it has two teams there
+    assert stats(root) == (1, 2)
+    assert stats(left) == (1, 1)
+    assert stats(right) == (1, 1)
+    assert stats(other) == (0, 0)
+
+    ret = client.put(f'/experiments/{experiment_id}', json={"team_ids": [left.id, other.id]})
+    assert ret.status_code == 200
+
+    assert stats(root) == (1, 2)
+    assert stats(right) == (0, 0)
+    assert stats(other) == (1, 1)
+
+    ret = client.get('/teams/0/stats')
+    assert ret.status_code == 404
+    assert ret.json == 'Team not found!'
+
+
+def test_team_stats_concurrent_move(client, session):
+    """Test experiment links wait for a concurrent move to count for the new ancestors."""
+
+    p1, p2 = TeamFactory.create_batch(2)
+    team = TeamFactory(parent_team_id=p1.id)
+    experiment = ExperimentFactory()
+    session.commit()
+
+    def move():
+        with db_models.engine.connect() as connection:
+            connection.execute(
+                text("UPDATE team SET parent_team_id = :p2 WHERE id = :id"),
+                {"p2": p2.id, "id": team.id},
+            )
+            connection.commit()
+
+    with db_models.engine.connect() as connection:
+        # E linked to the team, not committed yet
+        connection.execute(
+            text("INSERT INTO experiments_teams (experiment_id, team_id) VALUES (:e, :t)"),
+            {"e": experiment.id, "t": team.id},
+        )
+
+        # the move waits for it, or it would not carry it along to P2
+        thread = threading.Thread(target=move)
+        thread.start()
+        thread.join(timeout=0.5)
+        assert thread.is_alive()
+
+        connection.commit()
+
+    thread.join()
+    for parent, subtree_experiments in ((p1, 0), (p2, 1)):
+        ret = client.get(f'/teams/{parent.id}/stats')
+        assert ret.json['subtree_experiments'] == subtree_experiments
+
+
+def test_get_teams(client):
+    """Test team listing."""
+
+    t1 = TeamFactory(name='c')
+    t2 = TeamFactory(name='a', parent_team_id=t1.id)
+    t3 = TeamFactory(name='b', parent_team_id=t1.id)
+
+    ret = client.get('/teams')
+    assert ret.status_code == 200
+    assert ret.json == {
+        'data': [
+            {'id': t1.id, 'name': 'c', 'parent_team_id': None},
+            {'id': t2.id, 'name': 'a', 'parent_team_id': t1.id},
+            {'id': t3.id, 'name': 'b', 'parent_team_id': t1.id},
+        ],
+        'meta': {
+            'items': 3,
+            'limit': 25,
+            'order_by': 'asc',
+            'page': 1,
+            'sort_by': 'id',
+            'next_cursor': None,
+        },
+    }
+
+    # Walk the whole list page by page following the cursors
+    for qs, expected in [
+        ({"limit": 2}, [t1.id, t2.id, t3.id]),
+        ({"limit": 2, "sort_by": "name"}, [t2.id, t3.id, t1.id]),
+        ({"limit": 2, "sort_by": "name", "order_by": "desc"}, [t1.id, t3.id, t2.id]),
+    ]:
+        ids = []
+        while True:
+            ret = client.get('/teams', query_string=qs)
+            assert ret.status_code == 200
+            ids.extend(team["id"] for team in ret.json["data"])
+            if not (cursor := ret.json['meta']['next_cursor']):
+                break
+            qs = {**qs, "cursor": cursor}
+
+        assert ids == expected
+
+    ret = client.get('/teams', query_string={"sort_by": "parent_team_id"})
+    assert ret.status_code == 400
+
+    # Keys are checked against the types of the sort column and the id
+    for sort_by, key in [("name", [1, t1.id]), ("name", ["a", "1"]), ("id", ["a", t1.id])]:
+        cursor = resources.encode_cursor({"sort_by": sort_by, "order_by": "asc", "key": key})
+        ret = client.get('/teams', query_string={"sort_by": sort_by, "cursor": cursor})
+        assert ret.status_code == 400
+        assert ret.json == {'cursor': ['Invalid cursor.']}
+
+
+def test_get_team_subtree(client):
+    """Test reading a team subtree, nested."""
+
+    root = TeamFactory()
+    left = TeamFactory(parent_team_id=root.id)
+    right = TeamFactory(parent_team_id=root.id)
+    leaf = TeamFactory(parent_team_id=left.id)
+
+    ret = client.get(f'/teams/{root.id}/subtree')
+    assert ret.status_code == 200
+    assert ret.json == {
+        'data': {
+            'id': root.id,
+            'name': root.name,
+            'parent_team_id': None,
+            'children': [
+                {
+                    'id': left.id,
+                    'name': left.name,
+                    'children': [{'id': leaf.id, 'name': leaf.name, 'children': []}],
+                },
+                {'id': right.id, 'name': right.name, 'children': []},
+            ],
+        },
+        'meta': {'max_depth': None, 'items': 4},
+    }
+
+    ret = client.get(f'/teams/{root.id}/subtree', query_string={"max_depth": 1})
+    assert ret.status_code == 200
+    assert [child['children'] for child in ret.json['data']['children']] == [[], []]
+    assert ret.json['meta'] == {'max_depth': 1, 'items': 3}
+
+    ret = client.get(f'/teams/{left.id}/subtree', query_string={"max_depth": 0})
+    assert ret.json['data'] == {
+        'id': left.id,
+        'name': left.name,
+        'parent_team_id': root.id,
+        'children': [],
+    }
+
+    ret = client.get(f'/teams/{root.id}/subtree', query_string={"max_depth": -1})
+    assert ret.status_code == 400
+
+    ret = client.get('/teams/0/subtree')
+    assert ret.status_code == 404
+    assert ret.json == 'Team not found!'
+
+
+def test_update_team(client, session):
+    """Test moving a team below another parent."""
+
+    root, other_root = TeamFactory.create_batch(2)
+    child = TeamFactory(parent_team_id=root.id)
+    grandchild = TeamFactory(parent_team_id=child.id)
+
+    ret = client.post(
+        '/experiments',
+        json={
+            "description": "spread",
+            "sample_ratio": 50,
+            "team_ids": [grandchild.id, other_root.id],
+        },
+    )
+    experiment_id = ret.json['id']
+
+    # Below itself or its own subtree
+    for parent in (child, grandchild):
+        ret = client.patch(f'/teams/{child.id}', json={"parent_team_id": parent.id})
+        assert ret.status_code == 400
+        assert ret.json == 'A team cannot be moved below itself or its descendants'
+
+    # The experiment teams would become related
+    ret = client.patch(f'/teams/{child.id}', json={"parent_team_id": other_root.id})
+    assert ret.status_code == 400
+    assert ret.json == {
+        'experiments': {
+            str(experiment_id): 'Experiment teams cannot be descendents of one another'
+        }
+    }
+
+    ret = client.patch(f'/teams/{child.id}', json={"parent_team_id": None})
+    assert ret.status_code == 200
+    assert ret.json == {'id': child.id, 'name': child.name, 'parent_team_id': None}
+
+    ret = client.get(f'/teams/{root.id}/subtree')
+    assert ret.json['data']['children'] == []
+    ret = client.get(f'/teams/{root.id}/stats')
+    assert ret.json['subtree_experiments'] == 0
+    ret = client.get(f'/teams/{child.id}/stats')
+    assert ret.json['subtree_experiments'] == 1
+
+    # and back
+    ret = client.patch(f'/teams/{child.id}', json={"parent_team_id": root.id})
+    assert ret.status_code == 200
+    ret = client.get(f'/teams/{root.id}/subtree')
+    assert [team['id'] for team in ret.json['data']['children']] == [child.id]
+    ret = client.get(f'/teams/{root.id}/stats')
+    assert ret.json['subtree_experiments'] == 1
+
+    ret = client.patch(f'/teams/{child.id}', json={"parent_team_id": root.id})
+    assert ret.status_code == 200
+    assert ret.json == 'Nothing to update'
+
+    ret = client.patch(f'/teams/{child.id}', json={})
+    assert ret.status_code == 400
+    assert ret.json == {'parent_team_id': ['Missing data for required field.']}
+
+    ret = client.patch(f'/teams/{child.id}', json={"parent_team_id": 0})
+    assert ret.status_code == 404
+    assert ret.json == 'Specified parent not found'
+
+    ret = client.patch('/teams/0', json={"parent_team_id": root.id})
+    assert ret.status_code == 404
+    assert ret.json == 'Team not found!'
+
+
+def test_update_team_concurrent_moves(client, session):
+    """Test a move is checked against the hierarchy left by a concurrent one."""
+
+    x, y, p = TeamFactory.create_batch(3)
+    client.post(
+        '/experiments', json={"description": "", "sample_ratio": 1, "team_ids": [x.id, y.id]}
+    )
+    session.commit()
+
+    responses = []
+    with db_models.engine.connect() as connection:
+        # X moves below P, not committed yet
+        connection.execute(
+            text("UPDATE team SET parent_team_id = :p WHERE id = :x"), {"p": p.id, "x": x.id}
+        )
+
+        # P below Y would make X a descendant of Y
+        move = threading.Thread(
+            target=lambda: responses.append(
+                client.patch(f'/teams/{p.id}', json={"parent_team_id": y.id})
+            )
+        )
+        move.start()
+        move.join(timeout=0.5)
+        assert move.is_alive()
+
+        connection.commit()
+
+    move.join()
+    assert responses[0].status_code == 400
+    assert list(responses[0].json) == ['experiments']